@@ -0,0 +1,131 @@
+"""
+Generated fixtures for benchmarks.
+
+Shapes are built from a seeded random generator, so every run measures the same work.
+Each fixture gets its own generator, so what it builds doesn't depend on which
+benchmarks are selected, or the order fixtures are set up in.
+"""
+import json
+import math
+
+import numpy as np
+import pytest
+from shapely.geometry import MultiPolygon, Polygon, mapping
+
+from dorchester.point import Point
+
+SEED = 20210101
+
+
+def ring(cx, cy, radius, vertices, rng, jitter=0.2):
+    "A closed ring around (cx, cy), with some noise in the radius so it isn't a perfect circle"
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    radii = radius * (1 - jitter * rng.random(vertices))
+    coords = np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)])
+    return [tuple(c) for c in coords]
+
+
+def polygon(vertices, rng, cx=0, cy=0, radius=1, hole=False):
+    exterior = ring(cx, cy, radius, vertices, rng)
+    holes = []
+    if hole:
+        # jitter of zero keeps the hole well inside the exterior
+        holes.append(ring(cx, cy, radius / 3, max(vertices // 4, 3), rng, jitter=0))
+
+    return Polygon(exterior, holes)
+
+
+def multipolygon(parts, vertices, rng):
+    "Islands in a row, with sizes falling off like a coastline"
+    return MultiPolygon(
+        [polygon(vertices, rng, cx=i * 3, radius=1 / (i + 1)) for i in range(parts)]
+    )
+
+
+def shapes(rng):
+    return {
+        "simple": polygon(8, rng),
+        "detailed": polygon(1000, rng),
+        "holes": polygon(200, rng, hole=True),
+        "multipolygon": multipolygon(20, 50, rng),
+    }
+
+
+def census_like(count, rng):
+    """
+    A grid of block-sized polygons with a skewed population distribution,
+    where about a third of features have nobody living in them, like Census blocks.
+    """
+    side = math.ceil(math.sqrt(count))
+    features = []
+    for i in range(count):
+        x, y = divmod(i, side)
+        geom = polygon(int(rng.integers(4, 40)), rng, cx=x, cy=y, radius=0.45)
+        population = 0 if rng.random() < 0.35 else int(rng.lognormal(3, 1))
+        features.append(
+            {
+                "type": "Feature",
+                "id": str(i),
+                "geometry": mapping(geom),
+                "properties": {
+                    "GEOID": f"{i:06}",
+                    "POP": population,
+                    "WHITE": population // 2,
+                    "BLACK": population - population // 2,
+                },
+            }
+        )
+
+    return features
+
+
+def write_features(path, features):
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+    return path
+
+
+@pytest.fixture()
+def rng():
+    "A fresh generator for each test, so results don't depend on which tests run"
+    return np.random.default_rng(SEED)
+
+
+@pytest.fixture(scope="session")
+def geometries():
+    return shapes(np.random.default_rng(SEED))
+
+
+@pytest.fixture(scope="session")
+def features(geometries):
+    "One feature per shape, each with 10,000 people in two groups"
+    return {
+        name: {
+            "type": "Feature",
+            "id": name,
+            "geometry": mapping(geom),
+            "properties": {"WHITE": 5000, "BLACK": 5000},
+        }
+        for name, geom in geometries.items()
+    }
+
+
+@pytest.fixture(scope="session")
+def census_features():
+    "2,000 Census-like features, in memory"
+    return census_like(2000, np.random.default_rng(SEED))
+
+
+@pytest.fixture(scope="session")
+def census(tmp_path_factory, census_features):
+    "A Census-like source file with 2,000 features"
+    path = tmp_path_factory.mktemp("data") / "census.geojson"
+    return write_features(path, census_features)
+
+
+@pytest.fixture(scope="session")
+def points():
+    "100,000 points to write"
+    coords = np.random.default_rng(SEED).random((100000, 2))
+    return [Point(x, y, "population", "000001") for x, y in coords.tolist()]
@@ -0,0 +1,24 @@
+import pytest
+from click.testing import CliRunner
+
+from dorchester.cli import cli
+
+
+MODES = {
+    "single": [],
+    "multiprocessing": ["--multiprocessing"],
+    "pipeline": ["--pipeline"],
+}
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("format", ["csv", "geojson", "null"])
+def test_plot(benchmark, tmp_path, census, mode, format):
+    dest = tmp_path / f"points.{format}"
+    args = ["plot", str(census), str(dest), "-f", format, "-k", "WHITE", "-k", "BLACK"]
+    args.extend(MODES[mode])
+
+    runner = CliRunner()
+    result = benchmark.pedantic(runner.invoke, args=(cli, args), rounds=3, iterations=1)
+
+    assert result.exit_code == 0, result.output
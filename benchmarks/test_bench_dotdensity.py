@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from shapely.geometry import shape
+
+from dorchester import dotdensity
+
+SHAPES = ["simple", "detailed", "holes", "multipolygon"]
+
+
+@pytest.mark.parametrize("n", [1, 100, 10000])
+def test_points_on_triangle(benchmark, n):
+    vertices = [(0, 0), (1, 0), (0, 1)]
+    points = benchmark(dotdensity.points_on_triangle, vertices, n)
+
+    assert len(points) == n
+
+
+@pytest.mark.parametrize("name", SHAPES)
+@pytest.mark.parametrize("population", [10, 10000])
+def test_points_in_shape(benchmark, geometries, name, population):
+    geom = geometries[name]
+    points = benchmark(dotdensity.points_in_shape, geom, population)
+
+    assert len(points) == population
+
+
+@pytest.mark.parametrize("name", SHAPES)
+def test_points_in_feature(benchmark, features, name):
+    feature = features[name]
+    points = benchmark(dotdensity.points_in_feature, feature, ["WHITE", "BLACK"])
+
+    assert len(points) == 10000
+
+
+def test_points_in_feature_empty(benchmark, features):
+    "Zero-population features should cost next to nothing"
+    feature = features["detailed"]
+    points = benchmark(dotdensity.points_in_feature, feature, ["MISSING"])
+
+    assert points == []
+
+
+@pytest.mark.parametrize("n", [1000, 100000])
+def test_reproject(benchmark, rng, n):
+    from dorchester.reproject import Reprojector
+
+    reproject = Reprojector("EPSG:4326", "EPSG:3857")
+    coords = rng.random((n, 2))
+    result = benchmark(reproject, coords)
+
+    assert result.shape == (n, 2)
+
+
+@pytest.mark.parametrize("tolerance", [None, 0.001, 0.01])
+def test_points_in_feature_simplify(benchmark, features, tolerance):
+    feature = features["detailed"]
+    batches = benchmark(
+        lambda: list(
+            dotdensity.iter_points_in_feature(
+                feature, ["WHITE", "BLACK"], simplify=tolerance
+            )
+        )
+    )
+
+    assert sum(len(batch) for batch in batches) == 10000
+
+
+def test_points_from_features(benchmark, census_features):
+    batches = benchmark(
+        lambda: list(dotdensity.points_from_features(census_features, "WHITE", "BLACK"))
+    )
+
+    assert sum(len(batch) for batch in batches) == census_population(census_features)
+
+
+def test_points_from_arrays(benchmark, census_features):
+    pytest.importorskip("shapely", minversion="2.0")
+    from dorchester.vectorized import points_from_arrays
+
+    geoms = np.array([shape(f["geometry"]) for f in census_features])
+    groups = {
+        key: np.array([f["properties"][key] for f in census_features])
+        for key in ["WHITE", "BLACK"]
+    }
+    points = benchmark(points_from_arrays, geoms, groups)
+
+    assert len(points) == census_population(census_features)
+
+
+def census_population(features):
+    return sum(f["properties"]["POP"] for f in features)
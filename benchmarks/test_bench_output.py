@@ -0,0 +1,15 @@
+import pytest
+
+from dorchester.output import FORMATS
+
+
+@pytest.mark.parametrize("format", sorted(FORMATS))
+def test_write_all(benchmark, tmp_path, points, format):
+    Writer = FORMATS[format]
+    path = tmp_path / f"points.{format}"
+
+    def write():
+        with Writer(path, "w") as writer:
+            writer.write_all(points)
+
+    benchmark(write)
@@ -0,0 +1,28 @@
+"""
+Startup time matters when dorchester runs once per county from a batch script.
+Each benchmark runs a fresh interpreter.
+"""
+import subprocess
+import sys
+
+import pytest
+
+COMMANDS = {
+    "import": [sys.executable, "-c", "import dorchester.cli"],
+    "help": [sys.executable, "-m", "dorchester.cli", "--help"],
+    "version": [sys.executable, "-m", "dorchester.cli", "--version"],
+}
+
+
+@pytest.mark.parametrize("name", COMMANDS)
+def test_startup(benchmark, name):
+    command = COMMANDS[name]
+    result = benchmark.pedantic(
+        subprocess.run,
+        args=(command,),
+        kwargs=dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True),
+        rounds=10,
+        iterations=1,
+    )
+
+    assert result.returncode == 0
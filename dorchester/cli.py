@@ -1,18 +1,26 @@
+import cProfile
+import glob
+import json
 import logging
+import shutil
+from collections import Counter
+from contextlib import ExitStack
 from pathlib import Path
 
 import click
-import fiona
-
 from click_default_group import DefaultGroup
-from tqdm import tqdm
 
-from . import dotdensity
-from .dotdensity import get_feature_id
-from .output import FILE_TYPES, FORMATS
+# dotdensity, fiona and tqdm are imported where they're used,
+# so startup (and --help) stays fast
+from . import pipeline
+from .output import FILE_TYPES, FORMATS, STDOUT, SUFFIXES, CSVWriter
+from .stats import NullStats, Stats
 
 log = logging.getLogger("dorchester")
 
+# copy partial outputs in big chunks when merging
+MERGE_BUFFER_SIZE = 1024 * 1024
+
 
 @click.group(cls=DefaultGroup, default="plot")
 @click.version_option()
@@ -20,9 +28,25 @@ def cli():
     "A toolkit for making dot-density maps in Python"
 
 
+def parse_partition(ctx, param, value):
+    "Parse I/N into a (part, parts) pair"
+    if value is None:
+        return None
+
+    try:
+        part, parts = map(int, value.split("/"))
+    except ValueError:
+        raise click.BadParameter("should look like I/N, for example 0/4")
+
+    if not 0 <= part < parts:
+        raise click.BadParameter(f"I should be from 0 to {parts - 1}")
+
+    return part, parts
+
+
 @cli.command("plot")
-@click.argument("source", type=click.Path(exists=True))
-@click.argument("dest", type=click.Path(exists=False))
+@click.argument("sources", nargs=-1, required=True)
+@click.argument("dest", type=click.Path(exists=False, allow_dash=True))
 @click.option(
     "-k",
     "--key",
@@ -81,12 +105,100 @@ def cli():
     default=False,
     help="Use multiprocessing",
 )
+@click.option(
+    "--per-source",
+    is_flag=True,
+    default=False,
+    help="Write one output file per source, into DEST as a directory (requires --format)",
+)
+@click.option(
+    "--pipeline",
+    "pipelined",
+    is_flag=True,
+    default=False,
+    help="Read, sample and write in separate threads",
+)
+@click.option(
+    "--seed",
+    type=click.IntRange(min=0),
+    help="Seed random numbers, so the same input always gives the same points",
+)
+@click.option(
+    "--partition",
+    callback=parse_partition,
+    metavar="I/N",
+    help="Only plot part I of N (counting from 0), to split a job across machines",
+)
+@click.option(
+    "--partition-by",
+    type=click.Choice(["range", "hash"]),
+    default="range",
+    show_default=True,
+    help="Split partitions by ranges of features, or by a hash of each feature's ID",
+)
+@click.option(
+    "--to-crs",
+    help="Reproject points to this CRS, like EPSG:4326. Source CRS is read from each source.",
+)
+@click.option(
+    "--simplify",
+    type=click.FloatRange(min=0),
+    metavar="TOLERANCE",
+    help="Simplify detailed shapes before plotting, to this tolerance in source CRS units",
+)
+@click.option(
+    "--simplify-min-vertices",
+    type=click.IntRange(min=0),
+    default=100,
+    show_default=True,
+    help="Only simplify shapes with at least this many vertices",
+)
 @click.option("--log", "logfile", type=click.Path(dir_okay=False))
+@click.option(
+    "--stats",
+    "show_stats",
+    is_flag=True,
+    default=False,
+    help="Print timing for each stage, counts and peak memory when finished",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False),
+    help="Write stats to a JSON file (implies --stats)",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    help="Run under cProfile and dump results to this file",
+)
 def plot(
-    source, dest, keys, format, mode, fid_field, coerce, progress, count, mp, logfile
+    sources,
+    dest,
+    keys,
+    format,
+    mode,
+    fid_field,
+    coerce,
+    progress,
+    count,
+    mp,
+    per_source,
+    pipelined,
+    seed,
+    partition,
+    partition_by,
+    to_crs,
+    simplify,
+    simplify_min_vertices,
+    logfile,
+    show_stats,
+    stats_json,
+    profile,
 ):
     """
     Generate data for a dot-density map. Input may be any GIS format readable by Fiona (Shapefile, GeoJSON, etc).
+
+    Pass several sources, or a quoted glob like "blocks/*.shp", to plot them in one run.
     """
     if logfile:
         handler = logging.FileHandler(logfile, "w", "utf-8")
@@ -97,41 +209,253 @@ def plot(
         log.addHandler(handler)
         log.setLevel(logging.DEBUG)
 
-    source = Path(source)
-    dest = Path(dest)
+    sources = expand_sources(sources)
 
     if format in FORMATS:
         Writer = FORMATS[format]
 
+    elif per_source:
+        raise click.UsageError("--format is required with --per-source")
+
+    elif dest == STDOUT:
+        raise click.UsageError("--format is required when writing to stdout")
+
     else:
+        dest = Path(dest)
         Writer = FILE_TYPES.get(dest.suffix, None)
 
     if Writer is None:
         raise click.UsageError(f"Unknown file type: {dest.name}")
 
+    if per_source:
+        if dest == STDOUT:
+            raise click.UsageError("--per-source needs a directory, not stdout")
+
+        dest = Path(dest)
+        paths = per_source_paths(sources, dest, format)
+        dest.mkdir(parents=True, exist_ok=True)
+
+    if to_crs:
+        check_crs(sources, to_crs)
+
+    from . import dotdensity
+
+    stats = Stats() if show_stats or stats_json else None
+    counter = stats.counts if stats else Counter()
+    kwargs = dict(
+        fid_field=fid_field,
+        coerce=coerce,
+        seed=seed,
+        partition=partition,
+        partition_by=partition_by,
+        to_crs=to_crs,
+        simplify=simplify,
+        simplify_min_vertices=simplify_min_vertices,
+        counter=counter,
+        stats=stats,
+    )
+
     if mp:
-        generate_points = dotdensity.generate_points_mp
+        generator = dotdensity.generate_sources_mp(sources, *keys, **kwargs)
+    elif pipelined:
+        generator = dotdensity.generate_sources(
+            sources, *keys, prefetch=pipeline.QUEUE_SIZE, **kwargs
+        )
     else:
-        generate_points = dotdensity.generate_points
+        generator = dotdensity.generate_sources(sources, *keys, **kwargs)
 
-    generator = generate_points(source, *keys, fid_field=fid_field, coerce=coerce)
     if progress:
-        count = count or get_feature_count(source)
-        click.echo(f"{count} features")
-        generator = tqdm(generator, total=count, unit="features")
+        generator = show_progress(generator, sources, counter, count)
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+
+    log.debug(f"Sources: {', '.join(map(str, sources))}")
+    timer = (stats or NullStats()).timer
+    with ExitStack() as stack, ExitStack() as source_stack:
+        if not per_source:
+            writer = open_writer(stack, Writer, dest, mode, pipelined)
 
-    log.debug(f"Source: {source}")
-    with Writer(dest, mode) as writer:
         if not progress:
-            click.echo("Generating points ...")
+            click.echo("Generating points ...", err=True)
+
+        current = None
+        for source, points in generator:
+            # sources end with an empty batch, for progress bars
+            if not points:
+                continue
+
+            if per_source and source != current:
+                # finish the last source before starting the next
+                source_stack.close()
+                writer = open_writer(
+                    source_stack, Writer, paths[source], mode, pipelined
+                )
+                current = source
+
+            with timer("write"):
+                writer.write_all(points)
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(profile)
 
-        for points in generator:
-            writer.write_all(points)
+    if counter["skipped"]:
+        click.echo(
+            f"Skipped {counter['skipped']} features with no population", err=True
+        )
+
+    if stats:
+        stats.finish()
+        click.echo(stats.report(), err=True)
+
+    if stats_json:
+        with open(stats_json, "w") as f:
+            json.dump(stats.as_dict(), f, indent=2)
+
+
+@cli.command("merge")
+@click.argument("sources", nargs=-1, required=True, type=click.Path(exists=True))
+@click.argument("dest", type=click.Path(exists=False, allow_dash=True))
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice(FORMATS.keys(), case_sensitive=False),
+    help="Output format. If not given, will guess based on output file extension.",
+)
+def merge(sources, dest, format):
+    """
+    Combine outputs from partitioned runs of plot into one file.
+
+    Pass partial outputs in order (0/N first) to get the same order as a single run.
+    """
+    if format in FORMATS:
+        Writer = FORMATS[format]
+
+    elif dest == STDOUT:
+        raise click.UsageError("--format is required when writing to stdout")
+
+    else:
+        Writer = FILE_TYPES.get(Path(dest).suffix, None)
+
+    if Writer is None:
+        raise click.UsageError(f"Unknown file type: {dest}")
+
+    # CSV parts each start with a header, but we only want one
+    header = Writer is CSVWriter
+    out = click.open_file(dest, "wb")
+    with out:
+        for i, source in enumerate(sources):
+            with open(source, "rb") as f:
+                if header and i > 0:
+                    f.readline()
+
+                shutil.copyfileobj(f, out, MERGE_BUFFER_SIZE)
+
+
+def expand_sources(patterns):
+    "Expand any globs in *patterns*, and check that every source exists"
+    sources = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                raise click.BadParameter(
+                    f"No files match {pattern}", param_hint="SOURCES"
+                )
+
+            sources.extend(Path(match) for match in matches)
+
+        elif Path(pattern).exists():
+            sources.append(Path(pattern))
+
+        else:
+            raise click.BadParameter(
+                f"Path '{pattern}' does not exist.", param_hint="SOURCES"
+            )
+
+    return sources
+
+
+def per_source_paths(sources, dest, format):
+    "Name an output file in *dest* for each source, making sure no two share a name"
+    paths = {}
+    for source in sources:
+        path = dest / (source.stem + SUFFIXES[format])
+        clash = [other for other, p in paths.items() if p == path]
+        if clash:
+            raise click.UsageError(
+                f"{clash[0]} and {source} would both be written to {path}. "
+                "Rename one, or plot them separately."
+            )
+
+        paths[source] = path
+
+    return paths
+
+
+def check_crs(sources, to_crs):
+    "Make sure every source can be reprojected to *to_crs*, before plotting any of them"
+    import fiona
+
+    from .reproject import Reprojector
+
+    for source in sources:
+        with fiona.open(source) as src:
+            try:
+                Reprojector.for_source(src, to_crs)
+            except ValueError as e:
+                raise click.UsageError(str(e))
+
+
+def open_writer(stack, Writer, path, mode, pipelined=False):
+    "Open a writer on *stack*, in a background thread if *pipelined*"
+    writer = stack.enter_context(Writer(path, mode))
+    if pipelined:
+        writer = stack.enter_context(pipeline.BackgroundWriter(writer))
+
+    return writer
+
+
+def show_progress(generator, sources, counter, count=None):
+    """
+    Show a progress bar for each source as its points come through.
+
+    Bars count features from *counter*, including skipped ones, so they
+    move once per feature however many batches a feature is sampled in.
+    """
+    from tqdm import tqdm
+
+    bar = current = None
+    seen = counter["features"]
+    for source, points in generator:
+        if source != current:
+            if bar is not None:
+                bar.close()
+
+            if count and len(sources) == 1:
+                total = count
+            else:
+                total = get_feature_count(source)
+
+            click.echo(f"{total} features", err=True)
+            bar = tqdm(total=total, unit="features", desc=source.name)
+            current = source
+
+        bar.update(counter["features"] - seen)
+        seen = counter["features"]
+        yield source, points
+
+    if bar is not None:
+        bar.close()
 
 
 # for progress bars
 def get_feature_count(source):
-    click.echo(f"Counting features in {source}")
+    import fiona
+
+    click.echo(f"Counting features in {source}", err=True)
     with fiona.open(source) as fc:
         return len(fc)
 
@@ -4,103 +4,996 @@ The functions in this module outline the main API for creating the data behind d
 import itertools
 import logging
 import multiprocessing
-import random
+import zlib
+from collections import Counter
 from functools import partial
+from pathlib import Path
 
-import fiona
 import numpy as np
-from shapely.geometry import shape
+from shapely.geometry import mapping, shape
 from shapely.ops import triangulate
 
+from . import pipeline
 from .point import Point
+from .reproject import Reprojector
+from .stats import NullStats, Stats
 
 log = logging.getLogger("dorchester")
 
-# because I might change this later
+# most tasks sent to a worker at once
 CHUNKSIZE = 500
 
+# most points held in memory at once for a single feature
+BATCH_SIZE = 100000
 
-def generate_points(src, *keys, fid_field=None, coerce=False):
+# shapes with fewer vertices than this aren't worth simplifying
+SIMPLIFY_MIN_VERTICES = 100
+
+
+def generate_points(
+    src,
+    *keys,
+    fid_field=None,
+    coerce=False,
+    batch_size=BATCH_SIZE,
+    prefetch=0,
+    seed=None,
+    partition=None,
+    partition_by="range",
+    to_crs=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    counter=None,
+    stats=None,
+):
     """
     Generate dot-density data, reading from source and yielding points.
     Any keys given will be used to extract population properties from features.
 
-    For each feature, yield a generator of Point objects
+    Features with no population are skipped. Pass a Counter as *counter*
+    to track how many features were read and skipped.
+    Pass a Stats object as *stats* to time each stage.
+    If *prefetch* is greater than zero, features are read in a background thread,
+    staying up to that many features ahead of sampling.
+    If *seed* is given, results are repeatable; see feature_seed.
+    Pass a (part, parts) pair as *partition* to only plot some features;
+    see partition_features.
+    If *to_crs* is given, points are reprojected from the source's CRS,
+    one batch at a time. If *simplify* is given, shapes with at least
+    *simplify_min_vertices* vertices are simplified to that tolerance
+    before they're triangulated; see simplify_shape.
+
+    For each feature, yield a list of Point objects. Features with more than
+    *batch_size* people are broken up across several lists, so memory use stays
+    flat no matter how big a single feature is.
     """
+    import fiona
+
+    stats = stats or NullStats()
     with fiona.open(src) as source:
-        for feature in source:
-            log.debug(f"Feature: {get_feature_id(feature, fid_field)}")
-            yield points_in_feature(feature, keys, fid_field=fid_field, coerce=coerce)
+        transform = Reprojector.for_source(source, to_crs)
+        features = partition_features(
+            source, partition, by=partition_by, fid_field=fid_field
+        )
+        if prefetch:
+            features = pipeline.prefetch(features, prefetch)
+
+        features = stats.timed(features, "read")
+        yield from points_from_features(
+            features,
+            *keys,
+            fid_field=fid_field,
+            coerce=coerce,
+            batch_size=batch_size,
+            seed=source_seed(seed, src),
+            transform=transform,
+            simplify=simplify,
+            simplify_min_vertices=simplify_min_vertices,
+            counter=counter,
+            stats=stats,
+        )
+
+
+def points_from_features(
+    features,
+    *keys,
+    fid_field=None,
+    coerce=False,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    transform=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    counter=None,
+    stats=None,
+):
+    """
+    Like generate_points, but for features already in memory, so there's no file to read.
 
+    *features* can be any iterable of GeoJSON-like features, or anything with
+    a FeatureCollection __geo_interface__, like a GeoPandas GeoDataFrame.
+    (For a big GeoDataFrame, pass gdf.iterfeatures() to avoid building every
+    feature up front.) *transform* is a callable like a Reprojector, used as in
+    iter_points_in_feature. Other arguments work like they do in generate_points.
 
-def generate_points_mp(src, *keys, fid_field=None, coerce=False, chunksize=CHUNKSIZE):
-    with fiona.open(src) as source, multiprocessing.Pool() as pool:
-        f = partial(points_in_feature, keys=keys, fid_field=fid_field, coerce=coerce)
-        yield from pool.imap(f, source, chunksize)
+    Yield lists of Point objects, at most *batch_size* long.
+
+    With a *seed*, each feature is seeded by its ID (see feature_seed), so give
+    every feature a unique ID, or pass *fid_field*. Features without one
+    all get the same random numbers.
+    """
+    stats = stats or NullStats()
+    features = get_features(features)
+    for feature in skip_empty(features, keys, coerce=coerce, counter=counter):
+        log.debug(f"Feature: {get_feature_id(feature, fid_field)}")
+        yield from iter_points_in_feature(
+            feature,
+            keys,
+            fid_field=fid_field,
+            coerce=coerce,
+            batch_size=batch_size,
+            seed=seed,
+            transform=transform,
+            simplify=simplify,
+            simplify_min_vertices=simplify_min_vertices,
+            stats=stats,
+        )
+
+
+def points_from_features_mp(
+    features,
+    *keys,
+    fid_field=None,
+    coerce=False,
+    chunksize=CHUNKSIZE,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    transform=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    counter=None,
+    stats=None,
+):
+    """
+    Like points_from_features, but spread batches across a pool of worker processes.
+
+    Features (and *transform*) need to be picklable. Tasks are sent to workers
+    in chunks of at most *chunksize* tasks and *batch_size* dots (see chunk_tasks).
+    """
+    features = skip_empty(get_features(features), keys, coerce=coerce, counter=counter)
+    tasks = split_features(
+        features,
+        keys,
+        fid_field=fid_field,
+        coerce=coerce,
+        batch_size=batch_size,
+        seed=seed,
+        transform=transform,
+    )
+    f = partial(
+        _points_in_task,
+        fid_field=fid_field,
+        simplify=simplify,
+        simplify_min_vertices=simplify_min_vertices,
+        stats=stats is not None,
+    )
+
+    chunks = chunk_tasks(tasks, chunksize, batch_size)
+
+    with multiprocessing.Pool() as pool:
+        for results in pool.imap(partial(_map_chunk, f), chunks):
+            for result in results:
+                if stats is not None:
+                    result, worker_stats = result
+                    stats.update(worker_stats)
+
+                yield result
+
+
+def get_features(features):
+    "Get an iterable of features from *features*, unwrapping FeatureCollections"
+    geo = getattr(features, "__geo_interface__", features)
+    if isinstance(geo, dict) and geo.get("type") == "FeatureCollection":
+        return geo["features"]
+
+    return features
+
+
+def generate_points_mp(
+    src,
+    *keys,
+    fid_field=None,
+    coerce=False,
+    chunksize=CHUNKSIZE,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    partition=None,
+    partition_by="range",
+    to_crs=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    counter=None,
+    stats=None,
+):
+    """
+    Like generate_points, but spread features across a pool of worker processes.
+
+    Features with no population are dropped here, before they're sent to workers.
+    Large features are split into batches here, too, and each batch is sampled
+    by whichever worker picks it up.
+    If *stats* is given, each worker's timing and memory use is merged into it.
+    """
+    pairs = generate_sources_mp(
+        [src],
+        *keys,
+        fid_field=fid_field,
+        coerce=coerce,
+        chunksize=chunksize,
+        batch_size=batch_size,
+        seed=seed,
+        partition=partition,
+        partition_by=partition_by,
+        to_crs=to_crs,
+        simplify=simplify,
+        simplify_min_vertices=simplify_min_vertices,
+        counter=counter,
+        stats=stats,
+    )
+    for _, points in pairs:
+        if points:
+            yield points
+
+
+def generate_sources(sources, *keys, **kwargs):
+    """
+    Run generate_points over several sources, one after another.
 
+    Keyword arguments are passed to generate_points. Yield (source, points) pairs.
+    After each source, yield (source, []), so callers watching *counter* (for
+    a progress bar, say) see features skipped at the end of a source.
+    """
+    for src in sources:
+        for points in generate_points(src, *keys, **kwargs):
+            yield src, points
+
+        yield src, []
+
+
+def generate_sources_mp(
+    sources,
+    *keys,
+    fid_field=None,
+    coerce=False,
+    chunksize=CHUNKSIZE,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    partition=None,
+    partition_by="range",
+    to_crs=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    counter=None,
+    stats=None,
+):
+    """
+    Like generate_sources, but share one pool of worker processes across every source.
+
+    Sources are read largest first, so the longest jobs start early and workers
+    aren't left waiting on one big file at the end of a run. All points from
+    one source are yielded before the next source starts, followed by
+    (source, []), like generate_sources.
+
+    The pool reads ahead of what's been sampled, so *counter* is updated as
+    results come back, not as features are read. That way it tracks
+    features that are done, like it does without multiprocessing.
+    """
+    counter = Counter() if counter is None else counter
+    read = Counter()
+    sources = sorted(sources, key=source_size, reverse=True)
+    tasks = (
+        (src, counts, task)
+        for src in sources
+        for counts, task in count_tasks(
+            read_tasks(
+                src,
+                keys,
+                fid_field=fid_field,
+                coerce=coerce,
+                batch_size=batch_size,
+                seed=seed,
+                partition=partition,
+                partition_by=partition_by,
+                to_crs=to_crs,
+                counter=read,
+                stats=stats,
+            ),
+            read,
+        )
+    )
+    f = partial(
+        _points_in_source_task,
+        fid_field=fid_field,
+        simplify=simplify,
+        simplify_min_vertices=simplify_min_vertices,
+        stats=stats is not None,
+    )
+
+    chunks = chunk_tasks(tasks, chunksize, batch_size, size=source_task_size)
+
+    with multiprocessing.Pool() as pool:
+        for results in pool.imap(partial(_map_chunk, f), chunks):
+            for src, counts, result in results:
+                if stats is not None:
+                    result, worker_stats = result
+                    stats.update(worker_stats)
+
+                counter.update(counts)
+                yield src, result
+
+
+def chunk_tasks(tasks, chunksize=CHUNKSIZE, batch_size=BATCH_SIZE, size=None):
+    """
+    Group consecutive *tasks* into lists of at most *chunksize* tasks and *batch_size* dots.
+
+    A worker samples every task in a chunk before sending any results back,
+    so capping dots per chunk keeps each worker to about one batch in memory.
+    It also means batches of a big feature each go in their own chunk, and
+    get spread across workers, while lots of small features still share one.
+    *size* gets the number of dots in a task, and defaults to task_size.
+    """
+    size = size or task_size
+    chunk, dots = [], 0
+    for task in tasks:
+        n = size(task)
+        if chunk and (len(chunk) >= chunksize or dots + n > batch_size):
+            yield chunk
+            chunk, dots = [], 0
+
+        chunk.append(task)
+        dots += n
+
+    if chunk:
+        yield chunk
+
+
+def task_size(task):
+    "Number of dots a task will make"
+    if task is None:
+        return 0
+
+    _, groups, _, _ = task
+    return sum(groups.values())
+
+
+def source_task_size(task):
+    "Like task_size, for tasks from generate_sources_mp"
+    _, _, task = task
+    return task_size(task)
+
+
+def _map_chunk(f, chunk):
+    "Run *f* over a chunk of tasks in a worker process"
+    return [f(task) for task in chunk]
+
+
+def count_tasks(tasks, read):
+    """
+    Pair each task with the features counted in *read* since the task before it.
 
-def points_in_feature(feature, keys, fid_field=None, coerce=False):
+    A final None task carries any features skipped after the last real one.
+    *read* may already hold counts from earlier sources, which aren't repeated.
+    """
+    last = Counter(read)
+    for task in itertools.chain(tasks, [None]):
+        counts = {key: read[key] - last[key] for key in ("features", "skipped")}
+        last = Counter(read)
+        yield counts, task
+
+
+def read_tasks(
+    src,
+    keys,
+    fid_field=None,
+    coerce=False,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    partition=None,
+    partition_by="range",
+    to_crs=None,
+    counter=None,
+    stats=None,
+):
+    "Read features from *src* and yield a task for each batch (see split_features)"
+    import fiona
+
+    with fiona.open(src) as source:
+        transform = Reprojector.for_source(source, to_crs)
+        features = partition_features(
+            source, partition, by=partition_by, fid_field=fid_field
+        )
+        if stats is not None:
+            features = stats.timed(features, "read")
+
+        features = skip_empty(features, keys, coerce=coerce, counter=counter)
+        yield from split_features(
+            features,
+            keys,
+            fid_field=fid_field,
+            coerce=coerce,
+            batch_size=batch_size,
+            seed=source_seed(seed, src),
+            transform=transform,
+        )
+
+
+def source_size(src):
+    "Size of a source on disk, in bytes, used to schedule big files first"
+    path = Path(src)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+    return path.stat().st_size
+
+
+def split_features(
+    features,
+    keys,
+    fid_field=None,
+    coerce=False,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    transform=None,
+):
+    """
+    Yield a (feature, groups, seed, transform) task for each batch of each feature.
+
+    Large multi-part features are split into one feature per part first
+    (see split_parts), and chunk_tasks sends those parts to different workers.
+    Batches and their seeds match what iter_points_in_feature would use,
+    so a seeded run gives the same points with or without multiprocessing.
+    """
+    for feature in features:
+        fid = get_feature_id(feature, fid_field)
+        groups = get_groups(feature, keys, coerce=coerce)
+        rng = get_rng(seed, fid, 0)
+        batches = (
+            (part, batch)
+            for part, part_groups in split_parts(feature, groups, batch_size, rng=rng)
+            for batch in split_groups(part_groups, batch_size, rng=rng)
+        )
+        for i, (part, batch) in enumerate(batches, 1):
+            yield part, batch, feature_seed(seed, fid, i), transform
+
+
+def partition_features(features, partition=None, by="range", fid_field=None):
+    """
+    Select one part of *features*, so a job can be split across machines.
+
+    *partition* is a (part, parts) pair, counting parts from zero. Running
+    every part from 0 to parts - 1 covers each feature exactly once.
+
+    By "range", each part is a contiguous slice of features, in order,
+    so concatenating outputs from each part gives the same order as one run.
+    This needs len(features). By "hash", features are assigned by a hash
+    of their ID, which works for any iterable.
+    """
+    if partition is None:
+        return features
+
+    part, parts = partition
+    if not 0 <= part < parts:
+        raise ValueError(f"Partition {part}/{parts} is out of range")
+
+    if by == "hash":
+        return (
+            f
+            for f in features
+            if fid_hash(get_feature_id(f, fid_field)) % parts == part
+        )
+
+    if by != "range":
+        raise ValueError(f"Unknown partition method: {by}")
+
+    count = len(features)
+    start, stop = count * part // parts, count * (part + 1) // parts
+
+    # fiona collections can skip straight to the start of a range
+    if hasattr(features, "filter"):
+        return features.filter(start, stop)
+
+    return itertools.islice(features, start, stop)
+
+
+def feature_seed(seed, fid, *extra):
+    """
+    Build a seed for one feature from a run's *seed* and the feature's ID.
+
+    Seeding each feature on its own means a feature's points don't depend on
+    which process or partition plotted it, or on what was plotted before it.
+    *seed* may be a list, like the ones from source_seed.
+    Returns None if *seed* is None.
+    """
+    if seed is None:
+        return None
+
+    seed = list(seed) if isinstance(seed, (list, tuple)) else [seed]
+    return [*seed, fid_hash(fid), *extra]
+
+
+def source_seed(seed, src):
+    """
+    Mix the name of source file *src* into a run's *seed*.
+
+    Feature IDs often restart in every file (fiona numbers features from 0),
+    so without this, feature 0 in every source would get the same points.
+    Only the file name is used, not its directory, so every partition of a
+    source gets the same seeds wherever it's plotted.
+    Returns None if *seed* is None.
+    """
+    if seed is None:
+        return None
+
+    return [seed, fid_hash(Path(src).name)]
+
+
+def get_rng(seed=None, *extra):
+    """
+    Get a random number generator for *seed*. If more arguments are given,
+    they're passed to feature_seed along with *seed*.
+
+    Without a seed, use numpy's global random state.
+    """
+    if seed is None:
+        return np.random
+
+    if extra:
+        seed = feature_seed(seed, *extra)
+
+    entropy = np.random.SeedSequence(seed).generate_state(4)
+    return np.random.RandomState(entropy)
+
+
+def fid_hash(fid):
+    "A hash of a feature ID that's the same in every process (unlike hash())"
+    return zlib.crc32(str(fid).encode("utf-8"))
+
+
+def _points_in_task(
+    task,
+    fid_field=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    stats=False,
+):
+    """
+    Sample one batch of a feature in a worker process.
+    If *stats* is true, send back timing and memory use with the result.
+    A None task has nothing to sample (see count_tasks), and gives no points.
+    """
+    worker_stats = Stats() if stats else None
+    if task is None:
+        points = []
+    else:
+        feature, groups, seed, transform = task
+        points = points_in_batch(
+            feature,
+            groups,
+            fid_field=fid_field,
+            rng=get_rng(seed),
+            transform=transform,
+            simplify=simplify,
+            simplify_min_vertices=simplify_min_vertices,
+            stats=worker_stats,
+        )
+
+    if stats:
+        worker_stats.sample_rss()
+        return points, worker_stats
+
+    return points
+
+
+def _points_in_source_task(task, **kwargs):
+    "Like _points_in_task, but keep track of which source (and counts) the task came with"
+    src, counts, task = task
+    return src, counts, _points_in_task(task, **kwargs)
+
+
+def skip_empty(features, keys, coerce=False, counter=None):
+    """
+    Yield only features with a population greater than zero.
+
+    If *counter* is given, it's updated with the number of features read and skipped.
+    """
+    counter = Counter() if counter is None else counter
+    for feature in features:
+        counter["features"] += 1
+        if sum(get_groups(feature, keys, coerce=coerce).values()) > 0:
+            yield feature
+        else:
+            counter["skipped"] += 1
+
+    log.info(f"Skipped {counter['skipped']} of {counter['features']} features")
+
+
+def points_in_feature(
+    feature, keys, fid_field=None, coerce=False, seed=None, stats=None
+):
     """
     Take a geojson *feature*, create a shape
     Get population from feature.properties using *key*
     Concatenate all points yielded from points_in_shape
     return a list of Point objects
     """
+    batches = iter_points_in_feature(
+        feature, keys, fid_field=fid_field, coerce=coerce, seed=seed, stats=stats
+    )
+    return list(itertools.chain.from_iterable(batches))
+
+
+def iter_points_in_feature(
+    feature,
+    keys,
+    fid_field=None,
+    coerce=False,
+    groups=None,
+    batch_size=BATCH_SIZE,
+    seed=None,
+    transform=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    stats=None,
+):
+    """
+    Like points_in_feature, but yield lists of at most *batch_size* Point objects.
+
+    The shape is parsed and triangulated once, then each batch is sampled
+    and assigned to groups before the next one starts, so only one batch of
+    points is ever held in memory. Large multi-part features are handled one
+    part at a time (see split_parts). Pass *groups* to use population counts
+    other than what's in feature.properties.
+
+    If *seed* is given, the split into batches and each batch's points are
+    seeded from it and the feature's ID. If *transform* is given, it's called
+    with each batch of coordinates, as an (n, 2) array, and should return
+    a new array (see Reprojector). *simplify* and *simplify_min_vertices*
+    are passed to simplify_shape.
+    """
     fid = get_feature_id(feature, fid_field)
+    if groups is None:
+        groups = get_groups(feature, keys, coerce=coerce)
 
-    geom = shape(feature["geometry"])
-    groups = {key: feature["properties"].get(key) or 0 for key in keys}
-    if coerce:
-        for key, population in groups.items():
-            # let this fail if it fails
-            groups[key] = int(population)
+    # nothing to draw, so don't bother parsing geometry
+    if sum(groups.values()) <= 0:
+        return
+
+    stats = stats or NullStats()
+    rng = get_rng(seed, fid, 0)
+    i = 0
+    for part, part_groups in split_parts(feature, groups, batch_size, rng=rng):
+        geom = parse_shape(part, simplify, simplify_min_vertices, stats=stats)
+        parts = triangulate_parts(geom, stats=stats)
+        for batch in split_groups(part_groups, batch_size, rng=rng):
+            i += 1
+            yield sample_batch(
+                parts,
+                batch,
+                fid,
+                rng=get_rng(seed, fid, i),
+                transform=transform,
+                stats=stats,
+            )
+
+
+def points_in_batch(
+    feature,
+    groups,
+    fid_field=None,
+    rng=np.random,
+    transform=None,
+    simplify=None,
+    simplify_min_vertices=SIMPLIFY_MIN_VERTICES,
+    stats=None,
+):
+    "Sample one batch of *groups* in a feature, returning a list of Point objects"
+    fid = get_feature_id(feature, fid_field)
+    stats = stats or NullStats()
+    geom = parse_shape(feature, simplify, simplify_min_vertices, stats=stats)
+    parts = triangulate_parts(geom, stats=stats)
+
+    return sample_batch(parts, groups, fid, rng=rng, transform=transform, stats=stats)
+
+
+def split_parts(feature, groups, batch_size=BATCH_SIZE, rng=np.random):
+    """
+    Split a large multi-part feature into one feature per part, dividing *groups* among them.
+
+    Each part gets a share of the population in proportion to its area,
+    and its groups are a random draw from what's left, like split_groups.
+    Yield (feature, groups) pairs, skipping parts with nobody in them.
+
+    Features with one part, or at most *batch_size* people, are yielded as
+    they are. Those are cheap enough to sample whole, and points_in_parts
+    still allocates their population part by part.
+    """
+    total = sum(groups.values())
+    if feature["geometry"]["type"] != "MultiPolygon" or total <= batch_size:
+        yield feature, groups
+        return
+
+    parts = get_parts(shape(feature["geometry"]))
+    populations = allocate_population([part.area for part in parts], total)
+    remaining = dict(groups)
+    for part, population in zip(parts, populations):
+        if population <= 0:
+            continue
+
+        part_groups = draw_groups(remaining, population, rng=rng)
+        for key, count in part_groups.items():
+            remaining[key] -= count
+
+        yield part_feature(feature, part), part_groups
+
+
+def part_feature(feature, part):
+    "A copy of *feature* with *part* as its geometry"
+    return {
+        "type": "Feature",
+        "id": feature.get("id"),
+        "geometry": mapping(part),
+        "properties": feature["properties"],
+    }
+
+
+def parse_shape(
+    feature, simplify=None, simplify_min_vertices=SIMPLIFY_MIN_VERTICES, stats=None
+):
+    "Create a shape from a feature's geometry, simplifying it if asked"
+    stats = stats or NullStats()
+    with stats.timer("parse"):
+        geom = shape(feature["geometry"])
+
+    if simplify:
+        with stats.timer("simplify"):
+            geom = simplify_shape(geom, simplify, simplify_min_vertices, stats=stats)
+
+    return geom
+
+
+def simplify_shape(geom, tolerance, min_vertices=SIMPLIFY_MIN_VERTICES, stats=None):
+    """
+    Simplify *geom* to *tolerance*, in the units of its CRS, preserving topology.
+
+    Shapes with fewer than *min_vertices* vertices are returned as they are,
+    since simplifying them costs more than it saves. Detailed boundaries,
+    like coastlines, can have thousands of vertices, all of which become
+    triangles, though the detail doesn't show at dot-density scale.
+
+    If *stats* is given, count shapes simplified, vertices removed and
+    an estimate of triangles saved.
+    """
+    vertices = count_vertices(geom)
+    if vertices < min_vertices:
+        return geom
+
+    simple = geom.simplify(tolerance, preserve_topology=True)
+    if simple.is_empty:
+        return geom
+
+    # counting saved triangles means more convex hulls, so only do it if asked
+    if stats is not None and not isinstance(stats, NullStats):
+        stats.counts["simplified"] += 1
+        stats.counts["vertices_saved"] += vertices - count_vertices(simple)
+        stats.counts["triangles_saved"] += count_triangles(geom) - count_triangles(
+            simple
+        )
+
+    return simple
+
+
+def count_vertices(geom):
+    "Count vertices in a polygon or multipolygon, not counting closing vertices"
+    if hasattr(geom, "geoms"):
+        return sum(count_vertices(part) for part in geom.geoms)
+
+    rings = [geom.exterior, *geom.interiors]
+    return sum(len(ring.coords) - 1 for ring in rings)
+
+
+def count_triangles(geom):
+    """
+    Estimate how many triangles triangulate(geom) will make, without running it.
+
+    A Delaunay triangulation of n points, h of them on the convex hull,
+    always has 2n - 2 - h triangles. Multi-part shapes are triangulated
+    one part at a time, so their parts are counted separately.
+    """
+    if hasattr(geom, "geoms"):
+        return sum(count_triangles(part) for part in geom.geoms)
 
-    # get a total
-    population = sum(groups.values())
+    n = count_vertices(geom)
+    hull = geom.convex_hull
+    h = len(hull.exterior.coords) - 1 if hull.geom_type == "Polygon" else n
+    return max(2 * n - 2 - h, 0)
 
-    points = points_in_shape(geom, population)
-    return list(distribute_points(points, groups, fid))
 
+def sample_batch(parts, groups, fid, rng=np.random, transform=None, stats=None):
+    "Sample points for *groups* across triangulated *parts* and assign them to groups"
+    stats = stats or NullStats()
+    with stats.timer("sample"):
+        points = points_in_parts(parts, sum(groups.values()), rng=rng)
 
-def points_in_shape(geom, population):
+    if transform is not None:
+        with stats.timer("reproject"):
+            points = transform(points)
+
+    with stats.timer("points"):
+        points = list(distribute_points(points, groups, fid, rng=rng))
+
+    stats.counts["dots"] += len(points)
+    return points
+
+
+def split_groups(groups, batch_size=BATCH_SIZE, rng=np.random):
+    """
+    Break up population *groups* into batches of at most *batch_size* people.
+
+    Each batch is a random draw, without replacement, from what's left,
+    so every batch mixes groups the same way shuffling the whole population would.
+    """
+    remaining = dict(groups)
+    total = sum(remaining.values())
+    while total > 0:
+        n = min(batch_size, total)
+        if n == total:
+            # everyone left fits, no need to draw
+            batch = dict(remaining)
+        else:
+            batch = draw_groups(remaining, n, rng=rng)
+
+        for key, count in batch.items():
+            remaining[key] -= count
+
+        total -= n
+        yield batch
+
+
+def draw_groups(groups, n, rng=np.random):
+    "Draw *n* people at random from *groups*, and return how many came from each"
+    drawn = {}
+    rest = sum(groups.values())
+    for key, count in groups.items():
+        rest -= count
+        if n <= 0 or count <= 0:
+            k = 0
+        elif rest <= 0:
+            k = n
+        else:
+            k = int(rng.hypergeometric(count, rest, n))
+
+        drawn[key] = k
+        n -= k
+
+    return drawn
+
+
+def points_in_shape(geom, population, rng=np.random, stats=None):
     """
     plot n points randomly within a shapely geom
-    first, cut the shape into triangles
-    then, give each triangle a portion of points based on relative area
+    first, split multipolygons into parts, and cut each part into triangles
+    then, give each part, and each triangle in it, a portion of points based on relative area
     within each triangle, distribute points using a weighted average
     return a list of (x, y) coordinates
     """
-    triangles = [t for t in triangulate(geom) if t.within(geom)]
+    if population <= 0:
+        return []
+
+    stats = stats or NullStats()
+    parts = triangulate_parts(geom, stats=stats)
+
+    with stats.timer("sample"):
+        return points_in_parts(parts, population, rng=rng)
+
+
+def get_parts(geom):
+    "The polygons in a shape: every part of a multipolygon, or just the shape itself"
+    if hasattr(geom, "geoms"):
+        return list(geom.geoms)
+
+    return [geom]
+
+
+def triangulate_parts(geom, stats=None):
+    """
+    Triangulate each part of *geom* on its own, returning a (triangles, area) pair per part.
+
+    Triangulating a multipolygon in one go makes lots of triangles spanning
+    the gaps between parts, which only get thrown away. Parts with no
+    triangles left (slivers, usually) are dropped.
+    """
+    stats = stats or NullStats()
+    parts = []
+    with stats.timer("triangulate"):
+        for part in get_parts(geom):
+            triangles = get_triangles(part)
+            if triangles:
+                parts.append((triangles, part.area))
+
+    stats.counts["triangles"] += sum(len(triangles) for triangles, _ in parts)
+    return parts
+
+
+def get_triangles(geom):
+    "Cut a shape into triangles, dropping any that fall outside it"
+    return [t for part in get_parts(geom) for t in triangulate(part) if t.within(part)]
+
+
+def points_in_parts(parts, population, rng=np.random):
+    "Spread *population* points across triangulated *parts*, weighted by each part's share of area"
+    populations = allocate_dots([area for _, area in parts], population, rng=rng)
     points = []
-    offset = -1 * population  # count up as we go
-    for triangle in triangles:
-        ratio = triangle.area / geom.area
-        n = round(ratio * population)
-        offset += n
-        vertices = triangle.exterior.coords[:3]
+    for (triangles, _), n in zip(parts, populations):
         if n > 0:
-            points.extend(points_on_triangle(vertices, n))
+            points.extend(sample_triangles(triangles, n, rng=rng))
+
+    return points
+
+
+def allocate_population(areas, population):
+    """
+    Split *population* into whole numbers in proportion to *areas*, using largest remainders.
+
+    The result always adds up to *population*, and every share is within
+    one of its exact quota, so small parts aren't starved by rounding.
+    """
+    if len(areas) == 1:
+        return [population]
+
+    areas = np.asarray(areas, dtype=float)
+    quotas = areas / areas.sum() * population
+    counts = np.floor(quotas).astype(int)
+    short = population - counts.sum()
+    counts[np.argsort(counts - quotas, kind="stable")[:short]] += 1
+    return counts.tolist()
+
+
+def allocate_dots(weights, population, rng=np.random):
+    """
+    Split *population* into whole numbers in proportion to *weights*, at random.
 
-    # too many points
-    if offset > 0:
-        return points[:-offset]
+    This is systematic sampling: shares are cut from one random offset, so
+    the total is always exact, every share is within one of its quota, and
+    on average every share matches its quota. Rounding each share on its own
+    would leave small shares at zero in every batch of a big feature.
+    """
+    if len(weights) == 1:
+        return [population]
+
+    cumulative = np.cumsum(np.asarray(weights, dtype=float))
+    cumulative = cumulative / cumulative[-1] * population
+    cumulative[-1] = population  # no rounding error at the end
 
-    # not enough, cycle through triangles until we do
-    triangles = itertools.cycle(triangles)
-    while offset < 0:
-        triangle = next(triangles)
-        vertices = triangle.exterior.coords[:3]
-        points.extend(points_on_triangle(vertices, 1))
-        offset += 1
+    edges = np.floor(cumulative + rng.rand()).astype(int)
+    return np.diff(edges, prepend=0).tolist()
+
+
+def sample_triangles(triangles, population, rng=np.random):
+    "Spread *population* points across *triangles*, weighted by each triangle's area"
+    counts = allocate_dots([t.area for t in triangles], population, rng=rng)
+    points = []
+    for triangle, n in zip(triangles, counts):
+        if n > 0:
+            vertices = triangle.exterior.coords[:3]
+            points.extend(points_on_triangle(vertices, n, rng=rng))
 
     return points
 
 
-def distribute_points(points, groups, fid):
+def distribute_points(points, groups, fid, rng=np.random):
     "Allocate randomized points to population groups"
     if len(groups) > 1:
         # don't bother shuffling if there's only one key
-        random.shuffle(points)
+        rng.shuffle(points)
 
     points = iter(points)
     for key, population in groups.items():
@@ -109,17 +1002,28 @@ def distribute_points(points, groups, fid):
 
 
 # https://stackoverflow.com/questions/47410054/generate-random-locations-within-a-triangular-domain
-def points_on_triangle(vertices, n):
+def points_on_triangle(vertices, n, rng=np.random):
     """
     Give n random points uniformly on a triangle.
 
     The vertices of the triangle are given by the shape
     (2, 3) array *vertices*: one vertex per row.
     """
-    x = np.sort(np.random.rand(2, n), axis=0)
+    x = np.sort(rng.rand(2, n), axis=0)
     return np.column_stack([x[0], x[1] - x[0], 1.0 - x[1]]) @ vertices
 
 
+def get_groups(feature, keys, coerce=False):
+    "Extract population counts from feature properties, one for each key"
+    groups = {key: feature["properties"].get(key) or 0 for key in keys}
+    if coerce:
+        for key, population in groups.items():
+            # let this fail if it fails
+            groups[key] = int(population)
+
+    return groups
+
+
 def get_feature_id(feature, fid_field=None):
     if fid_field:
         return feature["properties"][fid_field]
@@ -9,27 +9,39 @@ Supported types include:
  - SQLite
 """
 import csv
+import io
 import json
-import geojson
+import sys
 from pathlib import Path
 
 from .point import Point
 
+# pass this as a path to write to stdout
+STDOUT = "-"
+
+# stdout is wrapped in a buffer this big, so piping to another program
+# means fewer, larger writes
+STDOUT_BUFFER_SIZE = 1024 * 1024
+
 
 class Writer:
     """
     Base class for somewhat file-like output formatters
 
-    path is a string or Path-like object, to a file
+    path is a string or Path-like object, to a file, or "-" to write to stdout
     mode is a writing mode, like in open() https://docs.python.org/3/library/functions.html#open
     **kwargs may be passed to underlying resources, like csv.writer
     """
 
     def __init__(self, path, mode="w", **kwargs):
-        self.path = Path(path)
+        self.path = STDOUT if path == STDOUT else Path(path)
         self.mode = mode
         self._kwargs = kwargs
 
+    @property
+    def is_stdout(self):
+        return self.path == STDOUT
+
     def __enter__(self):
         self.open()
         return self
@@ -50,13 +62,30 @@ class Writer:
         for point in points:
             self.write(point)
 
+    def open_file(self):
+        "Open a text file for subclasses to write to"
+        if not self.is_stdout:
+            return open(self.path, self.mode)
+
+        buffer = io.BufferedWriter(sys.stdout.buffer, STDOUT_BUFFER_SIZE)
+        return io.TextIOWrapper(buffer, encoding="utf-8")
+
+    def close_file(self, fd):
+        "Close a file from open_file, flushing (but not closing) stdout"
+        if not self.is_stdout:
+            fd.close()
+            return
+
+        # detaching flushes each layer without closing stdout underneath
+        fd.detach().detach().flush()
+
 
 class CSVWriter(Writer):
     "Write points to a CSV file"
 
     def open(self):
         # points
-        self.fd = open(self.path, self.mode)
+        self.fd = self.open_file()
         self.writer = csv.writer(self.fd, **self._kwargs)
 
         # new file, write headings
@@ -64,7 +93,7 @@ class CSVWriter(Writer):
             self.writer.writerow(Point._fields)
 
     def close(self, type, value, traceback):
-        self.fd.close()
+        self.close_file(self.fd)
 
     def write(self, point):
         self.writer.writerow(point)
@@ -77,14 +106,18 @@ class GeoJSONWriter(Writer):
     "Write newline-delimited GeoJSON Point features to a file"
 
     def open(self):
-        self.fd = open(self.path, self.mode)
+        # imported here, so other formats don't pay for it at startup
+        import geojson
+
+        self.dumps = geojson.dumps
+        self.fd = self.open_file()
 
     def close(self, type, value, traceback):
-        self.fd.close()
+        self.close_file(self.fd)
 
     def write(self, point):
         feature = point.as_feature()
-        data = geojson.dumps(feature) + "\n"
+        data = self.dumps(feature) + "\n"
         self.fd.write(data)
 
 
@@ -105,4 +138,5 @@ class NullWriter(Writer):
 
 
 FORMATS = {"csv": CSVWriter, "geojson": GeoJSONWriter, "null": NullWriter}
+SUFFIXES = {"csv": ".csv", "geojson": ".geojson", "null": ""}
 FILE_TYPES = {".csv": CSVWriter, ".json": GeoJSONWriter, ".geojson": GeoJSONWriter}
@@ -0,0 +1,144 @@
+"""
+Threaded helpers for overlapping reading, sampling and writing in one process.
+
+Reading features and writing points mostly wait on disk, and NumPy releases
+the GIL while sampling, so running each in its own thread hides most I/O time
+even without multiprocessing. Queues between threads are bounded, so a slow
+stage holds the others back instead of filling up memory.
+"""
+import queue
+import threading
+
+# items buffered between threads
+QUEUE_SIZE = 64
+
+# how often blocked threads check if they should give up, in seconds
+POLL_INTERVAL = 0.1
+
+
+class _Done:
+    "Marks the end of a queue"
+
+
+class _Error:
+    "Carries an exception from a background thread"
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def prefetch(iterable, maxsize=QUEUE_SIZE):
+    """
+    Iterate over *iterable* in a background thread, staying up to *maxsize* items ahead.
+
+    Exceptions raised while reading are re-raised in the consuming thread.
+    If the consumer stops early, the reader thread is stopped and joined
+    before this generator exits, so it's safe to close the source afterward.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def read():
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+        except BaseException as exc:
+            _put(q, _Error(exc), stop)
+            return
+
+        _put(q, _Done, stop)
+
+    thread = threading.Thread(target=read, name="dorchester-reader", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = q.get()
+            if item is _Done:
+                break
+
+            if isinstance(item, _Error):
+                raise item.exc
+
+            yield item
+
+    finally:
+        stop.set()
+        thread.join()
+
+
+class BackgroundWriter:
+    """
+    Wrap a Writer so that write_all hands batches to a writer thread.
+
+    The wrapped writer is opened and closed by the caller, as usual:
+
+        with Writer(dest) as writer, BackgroundWriter(writer) as background:
+            for points in generator:
+                background.write_all(points)
+
+    Errors raised while writing are re-raised on the next call to write_all,
+    or when the BackgroundWriter closes.
+    """
+
+    def __init__(self, writer, maxsize=QUEUE_SIZE):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize)
+        self.stop = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._run, name="dorchester-writer", daemon=True
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            _put(self.queue, _Done, self.stop)
+        else:
+            # something went wrong upstream, don't wait on the rest
+            self.stop.set()
+
+        self.thread.join()
+        if type is None:
+            self._check()
+
+    def _run(self):
+        while not self.stop.is_set():
+            try:
+                points = self.queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            if points is _Done:
+                return
+
+            try:
+                self.writer.write_all(points)
+            except BaseException as exc:
+                self.error = exc
+                self.stop.set()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write_all(self, points):
+        self._check()
+        if not _put(self.queue, points, self.stop):
+            self._check()
+
+
+def _put(q, item, stop):
+    "Put *item* on *q*, giving up if *stop* is set. Returns whether the item was queued."
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+
+    return False
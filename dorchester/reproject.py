@@ -0,0 +1,51 @@
+"""
+Reproject generated points to another coordinate reference system.
+
+It's much cheaper to reproject dots than polygons: dots are sampled in the
+source CRS, then each batch is transformed with a single call to GDAL.
+"""
+import numpy as np
+
+
+class Reprojector:
+    """
+    Transform arrays of (x, y) coordinates from *src_crs* to *dst_crs*.
+
+    Either CRS may be anything GDAL understands, like "EPSG:4326" or WKT.
+    Reprojectors are picklable, so they can be sent to worker processes.
+    """
+
+    def __init__(self, src_crs, dst_crs):
+        self.src_crs = src_crs
+        self.dst_crs = dst_crs
+
+    def __repr__(self):
+        return f"Reprojector({self.src_crs!r}, {self.dst_crs!r})"
+
+    def __call__(self, coords):
+        "Reproject an (n, 2) array of coordinates, returning a new array"
+        # fiona loads GDAL, so wait until we need it
+        from fiona.transform import transform
+
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        if not len(coords):
+            return coords
+
+        xs, ys = transform(
+            self.src_crs, self.dst_crs, coords[:, 0].tolist(), coords[:, 1].tolist()
+        )
+        return np.column_stack([xs, ys])
+
+    @classmethod
+    def for_source(cls, source, dst_crs):
+        """
+        Build a Reprojector from an open fiona collection's CRS to *dst_crs*.
+        Returns None if *dst_crs* is None.
+        """
+        if dst_crs is None:
+            return None
+
+        if not source.crs_wkt:
+            raise ValueError(f"{source.path} has no CRS, so it can't be reprojected")
+
+        return cls(source.crs_wkt, dst_crs)
@@ -0,0 +1,165 @@
+"""
+This module keeps track of where time goes during a run.
+
+A Stats object accumulates wall and CPU time for each stage of plotting,
+along with feature and dot counts and peak memory use. Stats collected in
+worker processes can be merged back into the parent with update().
+"""
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# in the order they happen
+STAGES = [
+    "read",
+    "parse",
+    "simplify",
+    "triangulate",
+    "sample",
+    "reproject",
+    "points",
+    "write",
+]
+
+
+class Stats:
+    "Timing, counts and memory use for a run"
+
+    def __init__(self):
+        self.wall = defaultdict(float)
+        self.cpu = defaultdict(float)
+        self.counts = Counter()
+        self.rss = {}  # pid -> peak resident memory, in bytes
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @contextmanager
+    def timer(self, stage):
+        "Add time spent inside this block to *stage*"
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.wall[stage] += time.perf_counter() - wall
+            self.cpu[stage] += time.process_time() - cpu
+
+    def timed(self, iterable, stage):
+        "Yield from *iterable*, adding time spent waiting on each item to *stage*"
+        iterator = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def update(self, other):
+        "Merge stats from another run, usually a worker process"
+        for stage, seconds in other.wall.items():
+            self.wall[stage] += seconds
+
+        for stage, seconds in other.cpu.items():
+            self.cpu[stage] += seconds
+
+        self.counts.update(other.counts)
+        for pid, rss in other.rss.items():
+            self.rss[pid] = max(rss, self.rss.get(pid, 0))
+
+    def sample_rss(self):
+        "Record peak memory for the current process"
+        rss = peak_rss()
+        if rss is not None:
+            self.rss[os.getpid()] = max(rss, self.rss.get(os.getpid(), 0))
+
+    def finish(self):
+        self.sample_rss()
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        finished = self.finished or time.perf_counter()
+        return finished - self.started
+
+    def as_dict(self):
+        elapsed = self.elapsed
+        stages = sorted(self.wall, key=stage_order)
+        return {
+            "elapsed": elapsed,
+            "stages": {
+                stage: {"wall": self.wall[stage], "cpu": self.cpu[stage]}
+                for stage in stages
+            },
+            "counts": dict(self.counts),
+            "dots_per_second": self.counts["dots"] / elapsed if elapsed else 0,
+            "peak_rss": sum(self.rss.values()) if self.rss else None,
+            "processes": len(self.rss),
+        }
+
+    def report(self):
+        "A human-readable summary"
+        data = self.as_dict()
+        lines = [f"{'stage':<12} {'wall (s)':>10} {'cpu (s)':>10}"]
+        for stage, times in data["stages"].items():
+            lines.append(f"{stage:<12} {times['wall']:>10.3f} {times['cpu']:>10.3f}")
+
+        lines.append("")
+        for key, value in sorted(data["counts"].items()):
+            lines.append(f"{key}: {value:,}")
+
+        lines.append(f"elapsed: {data['elapsed']:.3f}s")
+        lines.append(f"dots/sec: {data['dots_per_second']:,.0f}")
+        if data["peak_rss"] is not None:
+            mb = data["peak_rss"] / 1024 / 1024
+            lines.append(f"peak RSS: {mb:,.1f} MB ({data['processes']} processes)")
+
+        return "\n".join(lines)
+
+
+class NullStats(Stats):
+    "Stats that skip timing, so instrumented code costs almost nothing when stats are off"
+
+    def timer(self, stage):
+        return NULL_TIMER
+
+    def timed(self, iterable, stage):
+        return iterable
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def peak_rss():
+    "Peak resident memory of this process, in bytes, or None if we can't tell"
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macos reports bytes
+    if sys.platform == "darwin":
+        return rss
+
+    return rss * 1024
+
+
+def stage_order(stage):
+    if stage in STAGES:
+        return (STAGES.index(stage), stage)
+
+    return (len(STAGES), stage)
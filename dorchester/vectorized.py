@@ -0,0 +1,134 @@
+"""
+Sample many geometries at once, from arrays instead of features.
+
+This is for data that's already in memory as Shapely geometry arrays and
+population arrays, like the columns of a GeoPandas GeoDataFrame:
+
+    coords, index = sample_geometries(gdf.geometry.values, gdf["POP10"].values)
+
+Every step, from triangulation to sampling, runs as one vectorized call over
+all geometries, using Shapely 2's array functions. All points are built in
+memory at once, so for very large populations, use the feature APIs in
+dotdensity, which work in batches.
+"""
+import numpy as np
+
+from .point import Point
+
+
+def sample_geometries(geometries, populations, rng=np.random):
+    """
+    Randomly place population[i] points inside geometries[i], for every i at once.
+
+    Each geometry is split into parts and cut into triangles, one part at a
+    time, like dotdensity.triangulate_parts. Its population is spread across
+    triangles in proportion to their area, using largest remainders so the
+    totals come out exact. Points are placed uniformly within each triangle.
+
+    Returns (coords, index): an (n, 2) array of coordinates, and an array of
+    length n giving the position of each point's geometry. Points are sorted
+    by geometry, but are in no particular order within a geometry.
+    """
+    shapely = _shapely()
+    geometries = np.asarray(geometries, dtype=object)
+    populations = np.asarray(populations).astype(np.int64)
+    if geometries.shape != populations.shape:
+        raise ValueError("geometries and populations must be the same length")
+
+    empty = (np.empty((0, 2)), np.empty(0, dtype=np.intp))
+    keep = np.flatnonzero((populations > 0) & ~shapely.is_missing(geometries))
+    if not len(keep):
+        return empty
+
+    # split multipolygons into parts, so no triangles span the gaps between them
+    parts, index = shapely.get_parts(geometries[keep], return_index=True)
+    part_owners = keep[index]
+
+    # triangulate every part, then drop triangles outside their part
+    collections = shapely.delaunay_triangles(parts)
+    triangles, index = shapely.get_parts(collections, return_index=True)
+    inside = shapely.within(triangles, parts[index])
+    triangles, owners = triangles[inside], part_owners[index[inside]]
+    if not len(triangles):
+        return empty
+
+    counts = allocate(shapely.area(triangles), owners, populations, len(geometries))
+
+    # each triangle is a closed ring of four coordinates; keep the first three
+    vertices = shapely.get_coordinates(triangles).reshape(-1, 4, 2)[:, :3]
+    which = np.repeat(np.arange(len(triangles)), counts)
+
+    # https://stackoverflow.com/questions/47410054/generate-random-locations-within-a-triangular-domain
+    x = np.sort(rng.rand(2, len(which)), axis=0)
+    weights = np.column_stack([x[0], x[1] - x[0], 1.0 - x[1]])
+    coords = np.einsum("ij,ijk->ik", weights, vertices[which])
+
+    return coords, owners[which]
+
+
+def allocate(areas, owners, populations, size):
+    """
+    Split each geometry's population across its triangles, by area.
+
+    *owners* gives the geometry for each triangle, and must be sorted.
+    Returns an integer count for each triangle.
+    """
+    totals = np.bincount(owners, weights=areas, minlength=size)
+    quotas = areas / totals[owners] * populations[owners]
+    counts = np.floor(quotas).astype(np.int64)
+
+    # hand out what's left to the largest remainders in each geometry
+    remaining = populations - np.bincount(owners, weights=counts, minlength=size)
+    order = np.lexsort((counts - quotas, owners))
+    ranked = owners[order]
+    rank = np.arange(len(order)) - np.searchsorted(ranked, ranked)
+    counts[order[rank < remaining[ranked]]] += 1
+
+    return counts
+
+
+def points_from_arrays(geometries, groups, fids=None, rng=np.random):
+    """
+    Generate Point objects for geometry and population arrays.
+
+    *groups* maps each group name to an array of populations, one per geometry.
+    *fids* are used to identify each point's geometry; by default, that's its
+    position in *geometries*. Points are mixed between groups at random within
+    each geometry, like distribute_points does.
+
+    Returns a list of Point objects.
+    """
+    names = list(groups)
+    counts = np.column_stack([np.asarray(groups[name]) for name in names])
+    counts = counts.astype(np.int64)
+
+    coords, index = sample_geometries(geometries, counts.sum(axis=1), rng=rng)
+    if fids is None:
+        fids = np.arange(len(counts))
+
+    # missing and degenerate geometries get no points, so drop their groups too
+    placed = np.bincount(index, minlength=len(counts))
+    counts[placed != counts.sum(axis=1)] = 0
+
+    # labels come out in geometry order, to match coords, then get
+    # shuffled within each geometry
+    labels = np.repeat(np.tile(np.arange(len(names)), len(counts)), counts.ravel())
+    shuffle = rng.permutation(len(labels))
+    shuffle = shuffle[np.argsort(index[shuffle], kind="stable")]
+
+    fids = np.asarray(fids, dtype=object)
+    return [
+        Point(x, y, names[label], fid)
+        for (x, y), label, fid in zip(
+            coords[shuffle].tolist(), labels.tolist(), fids[index[shuffle]]
+        )
+    ]
+
+
+def _shapely():
+    import shapely
+
+    if not hasattr(shapely, "delaunay_triangles"):
+        raise ImportError("Sampling arrays of geometries requires Shapely 2.0 or later")
+
+    return shapely
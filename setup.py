@@ -45,6 +45,7 @@ setup(
     install_requires=requirements,
     extras_require={
         "test": ["pytest", "pytest-xdist"],
+        "benchmark": ["pytest", "pytest-benchmark"],
         "notebooks": ["jupyter", "matplotlib", "descartes"],
     },
     tests_require=["dorchester[test]"],
@@ -1,9 +1,15 @@
 import csv
 import json
 import itertools
+import pstats
+import subprocess
+import sys
 from pathlib import Path
 
 import fiona
+import geojson
+import pytest
+import shapely.geometry
 from click.testing import CliRunner
 from dorchester.cli import cli
 
@@ -20,6 +26,26 @@ def test_version():
         assert result.output.startswith("cli, version ")
 
 
+def test_lazy_imports():
+    "Loading the CLI, or showing help, shouldn't import heavy dependencies"
+    code = (
+        "import sys\n"
+        "from click.testing import CliRunner\n"
+        "from dorchester.cli import cli\n"
+        "CliRunner().invoke(cli, ['plot', '--help'])\n"
+        "heavy = {'fiona', 'geojson', 'numpy', 'shapely', 'tqdm'}\n"
+        "print(','.join(sorted(heavy & set(sys.modules))))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == ""
+
+
 def test_plot(tmpdir, source, feature_collection):
     dest = tmpdir / "output.csv"
     population = sum(f.properties["population"] for f in feature_collection.features)
@@ -56,6 +82,288 @@ def test_plot_geojson(tmpdir, source, feature_collection):
         assert len(points) == population
 
 
+def test_plot_pipeline(tmpdir, source, feature_collection):
+    dest = tmpdir / "output.csv"
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli, ["plot", str(source), str(dest), "--key", "population", "--pipeline"]
+    )
+
+    assert result.exit_code == 0
+    assert dest.exists()
+
+    points = list(csv.DictReader(dest.open()))
+
+    assert len(points) == population
+
+
+def test_plot_stdout(source, feature_collection):
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli, ["plot", str(source), "-", "--key", "population", "-f", "geojson"]
+    )
+
+    assert result.exit_code == 0
+
+    points = list(decode_json_newlines(result.stdout.splitlines()))
+
+    assert len(points) == population
+
+
+def test_plot_stdout_requires_format(source):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["plot", str(source), "-", "--key", "population"])
+
+    assert result.exit_code == 2
+    assert "--format" in result.output
+
+
+@pytest.fixture()
+def sources(tmp_path, feature_collection):
+    "Three copies of the same collection, in different files"
+    paths = []
+    for i in range(3):
+        path = tmp_path / "sources" / f"fc-{i}.geojson"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(geojson.dumps(feature_collection))
+        paths.append(path)
+
+    return paths
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_plot_many(tmpdir, sources, feature_collection, mp):
+    dest = tmpdir / "output.csv"
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    args = ["plot", *map(str, sources), str(dest), "--key", "population"]
+    if mp:
+        args.append("--multiprocessing")
+
+    result = CliRunner().invoke(cli, args)
+
+    assert result.exit_code == 0
+    assert len(list(csv.DictReader(dest.open()))) == population * len(sources)
+
+
+def test_plot_glob(tmpdir, sources, feature_collection):
+    dest = tmpdir / "output.csv"
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    pattern = str(sources[0].parent / "*.geojson")
+
+    result = CliRunner().invoke(
+        cli, ["plot", pattern, str(dest), "--key", "population", "--progress"]
+    )
+
+    assert result.exit_code == 0
+    assert len(list(csv.DictReader(dest.open()))) == population * len(sources)
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_plot_progress(tmp_path, mp):
+    "Progress counts every feature once, skipped or split into batches"
+    features = [
+        geojson.Feature(i, geojson.Polygon([[(0, 0), (1, 0), (0, 1), (0, 0)]]), {})
+        for i in range(6)
+    ]
+    for i, f in enumerate(features):
+        # half empty, including the last feature, and one needing several batches
+        f.properties["population"] = [0, 5, 0, 100001, 5, 0][i]
+
+    source = tmp_path / "progress.geojson"
+    source.write_text(geojson.dumps(geojson.FeatureCollection(features)))
+    args = ["plot", str(source), str(tmp_path / "out.csv"), "-k", "population"]
+    args.append("--progress")
+    if mp:
+        args.append("--multiprocessing")
+
+    result = CliRunner().invoke(cli, args)
+
+    assert result.exit_code == 0
+    assert "6/6" in result.output
+    assert "7/6" not in result.output
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_plot_sources_counts(tmp_path, mp):
+    "Feature and skip counts add up across sources, with or without multiprocessing"
+    triangle = geojson.Polygon([[(0, 0), (1, 0), (0, 1), (0, 0)]])
+    sources = []
+    for name, populations in [("a", [0, 5, 0, 5, 0]), ("b", [5, 0, 0])]:
+        features = [
+            geojson.Feature(i, triangle, {"population": population})
+            for i, population in enumerate(populations)
+        ]
+        path = tmp_path / f"{name}.geojson"
+        path.write_text(geojson.dumps(geojson.FeatureCollection(features)))
+        sources.append(str(path))
+
+    stats = tmp_path / "stats.json"
+    args = ["plot", *sources, str(tmp_path / "out.csv"), "-k", "population"]
+    args += ["--progress", "--stats-json", str(stats)]
+    if mp:
+        args.append("--multiprocessing")
+
+    result = CliRunner().invoke(cli, args)
+    counts = json.loads(stats.read_text())["counts"]
+
+    assert result.exit_code == 0
+    assert counts["features"] == 8
+    assert counts["skipped"] == 5
+    assert "Skipped 5 features" in result.output
+    assert "5/5" in result.output
+    assert "3/3" in result.output
+    assert "8features" not in result.output
+
+
+def test_plot_missing_source(tmpdir):
+    dest = tmpdir / "output.csv"
+    result = CliRunner().invoke(
+        cli, ["plot", str(tmpdir / "nope-*.shp"), str(dest), "--key", "population"]
+    )
+
+    assert result.exit_code == 2
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_plot_per_source(tmp_path, sources, feature_collection, mp):
+    dest = tmp_path / "output"
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    args = ["plot", *map(str, sources), str(dest), "-k", "population", "-f", "csv"]
+    args.append("--per-source")
+    if mp:
+        args.append("--multiprocessing")
+
+    result = CliRunner().invoke(cli, args)
+
+    assert result.exit_code == 0
+    for source in sources:
+        path = dest / f"{source.stem}.csv"
+        assert len(list(csv.DictReader(path.open()))) == population
+
+
+def test_per_source_same_name(tmp_path, source):
+    "Sources with the same name would overwrite each other's output"
+    other = tmp_path / "other" / source.name
+    other.parent.mkdir()
+    other.write_text(source.read_text())
+    dest = tmp_path / "output"
+    args = ["plot", str(source), str(other), str(dest), "-k", "population"]
+    result = CliRunner().invoke(cli, args + ["-f", "csv", "--per-source"])
+
+    assert result.exit_code == 2
+    assert "would both be written" in result.output
+    assert not dest.exists()
+
+
+def test_per_source_requires_format(tmp_path, sources):
+    args = ["plot", *map(str, sources), str(tmp_path), "-k", "population"]
+    result = CliRunner().invoke(cli, args + ["--per-source"])
+
+    assert result.exit_code == 2
+    assert "--format" in result.output
+
+
+@pytest.mark.parametrize("by", ["range", "hash"])
+@pytest.mark.parametrize("suffix", ["csv", "json"])
+def test_partition_merge(tmp_path, source, by, suffix):
+    "Partitioned runs, merged, match a single run with the same seed"
+    runner = CliRunner()
+    base = ["plot", str(source), "--key", "population", "--fid", "geoid"]
+    base += ["--seed", "42"]
+
+    single = tmp_path / f"single.{suffix}"
+    result = runner.invoke(cli, base[:2] + [str(single)] + base[2:])
+    assert result.exit_code == 0
+
+    parts = []
+    for i in range(3):
+        part = tmp_path / f"part-{i}.{suffix}"
+        args = base[:2] + [str(part)] + base[2:]
+        args += ["--partition", f"{i}/3", "--partition-by", by]
+        result = runner.invoke(cli, args)
+        assert result.exit_code == 0
+        parts.append(str(part))
+
+    merged = tmp_path / f"merged.{suffix}"
+    result = runner.invoke(cli, ["merge", *parts, str(merged)])
+    assert result.exit_code == 0
+
+    if by == "range":
+        assert merged.read_text() == single.read_text()
+    else:
+        assert sorted(merged.read_text().splitlines()) == sorted(
+            single.read_text().splitlines()
+        )
+
+
+def test_bad_partition(tmp_path, source):
+    dest = tmp_path / "output.csv"
+    runner = CliRunner()
+    for value in ["3/3", "x", "1/0"]:
+        result = runner.invoke(
+            cli,
+            ["plot", str(source), str(dest), "-k", "population", "--partition", value],
+        )
+        assert result.exit_code == 2
+
+
+def test_to_crs(tmpdir, source, feature_collection):
+    "Reprojecting to the source's own CRS shouldn't change anything"
+    dest = tmpdir / "output.csv"
+    reprojected = tmpdir / "reprojected.csv"
+    runner = CliRunner()
+    args = ["plot", str(source), "--key", "population", "--seed", "1"]
+
+    result = runner.invoke(cli, args[:2] + [str(dest)] + args[2:])
+    assert result.exit_code == 0
+
+    result = runner.invoke(
+        cli, args[:2] + [str(reprojected)] + args[2:] + ["--to-crs", "OGC:CRS84"]
+    )
+    assert result.exit_code == 0
+
+    for a, b in zip(csv.DictReader(dest.open()), csv.DictReader(reprojected.open())):
+        assert float(a["x"]) == pytest.approx(float(b["x"]))
+        assert float(a["y"]) == pytest.approx(float(b["y"]))
+
+
+def test_simplify(tmp_path):
+    feature = geojson.Feature(
+        1, shapely.geometry.Point(0, 0).buffer(1, resolution=250), {"population": 500}
+    )
+    source = tmp_path / "circle.geojson"
+    source.write_text(geojson.dumps(geojson.FeatureCollection([feature])))
+    dest = tmp_path / "output.csv"
+    stats_file = tmp_path / "stats.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "plot",
+            str(source),
+            str(dest),
+            "-k",
+            "population",
+            "--simplify",
+            "0.01",
+            "--stats-json",
+            str(stats_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert len(list(csv.DictReader(dest.open()))) == 500
+
+    stats = json.loads(stats_file.read_text())
+    assert stats["counts"]["simplified"] == 1
+    assert stats["counts"]["vertices_saved"] > 0
+    assert "simplify" in stats["stages"]
+
+
 def test_custom_fid(tmpdir, source, feature_collection):
     dest = tmpdir / "output.csv"
     runner = CliRunner()
@@ -99,6 +407,56 @@ def test_coerce_ints(tmpdir, source, feature_collection):
         assert len(points) == cats
 
 
+def test_stats(tmpdir, source, feature_collection):
+    dest = tmpdir / "output.csv"
+    stats_file = tmpdir / "stats.json"
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli,
+        [
+            "plot",
+            str(source),
+            str(dest),
+            "--key",
+            "population",
+            "--stats",
+            "--stats-json",
+            str(stats_file),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert "dots/sec" in result.output
+
+    stats = json.loads(stats_file.read_text("utf-8"))
+    assert stats["counts"]["dots"] == population
+    assert set(stats["stages"]) >= {"read", "triangulate", "sample", "write"}
+
+
+def test_profile(tmpdir, source):
+    dest = tmpdir / "output.csv"
+    profile = tmpdir / "plot.profile"
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli,
+        [
+            "plot",
+            str(source),
+            str(dest),
+            "--key",
+            "population",
+            "--profile",
+            str(profile),
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert pstats.Stats(str(profile)).total_calls > 0
+
+
 def test_suffolk_county(tmpdir):
     dest = tmpdir / "suffolk.csv"
     runner = CliRunner()
@@ -228,3 +586,31 @@ def regroup(iterable, key):
     for key, group in itertools.groupby(iterable, key):
         groups[key] = list(group)
     return groups
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_plot_to_crs_without_crs(tmp_path, mp):
+    "Sources with no CRS (like a shapefile without a .prj) can't be reprojected"
+    source = tmp_path / "blocks.shp"
+    schema = {"geometry": "Polygon", "properties": {"population": "int"}}
+    with fiona.open(source, "w", driver="ESRI Shapefile", schema=schema) as dst:
+        dst.write(
+            {
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[(0, 0), (1, 0), (0, 1), (0, 0)]],
+                },
+                "properties": {"population": 10},
+            }
+        )
+
+    args = ["plot", str(source), str(tmp_path / "out.csv"), "-k", "population"]
+    args += ["--to-crs", "EPSG:4326"]
+    if mp:
+        args.append("--multiprocessing")
+
+    result = CliRunner().invoke(cli, args)
+
+    assert result.exit_code == 2
+    assert "has no CRS" in result.output
+    assert not isinstance(result.exception, ValueError)
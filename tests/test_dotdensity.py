@@ -1,5 +1,6 @@
 import csv
 import itertools
+from collections import Counter
 
 import geojson
 import pytest
@@ -9,6 +10,7 @@ from shapely.ops import triangulate
 
 from dorchester.point import Point
 from dorchester import dotdensity
+from dorchester.stats import NullStats, Stats
 from conftest import feature
 
 
@@ -168,6 +170,417 @@ def test_missing_field():
     assert len(list(points)) == 0
 
 
+def test_zero_population_skips_geometry():
+    "Features with no population shouldn't need valid geometry at all"
+    f = {"id": 1, "geometry": None, "properties": {"population": 0}}
+    points = dotdensity.points_in_feature(f, ["population"])
+
+    assert points == []
+    assert dotdensity.points_in_shape(None, 0) == []
+
+
+def test_skip_empty():
+    features = [
+        feature(0, 5, population=100),
+        feature(1, 5, population=0),
+        feature(2, 5, population=None),
+        feature(3, 5, population=10),
+    ]
+    counter = Counter()
+    kept = list(dotdensity.skip_empty(features, ["population"], counter=counter))
+
+    assert [f.id for f in kept] == [0, 3]
+    assert counter["features"] == 4
+    assert counter["skipped"] == 2
+
+
+def test_generate_points_mp_skips_empty(tmp_path):
+    fc = geojson.FeatureCollection(
+        [feature(i, 5, population=(i % 2) * 10) for i in range(10)]
+    )
+    fc.features = [f for f in fc.features if geometry.shape(f.geometry).is_valid]
+    path = tmp_path / "fc.geojson"
+    path.write_text(geojson.dumps(fc))
+
+    counter = Counter()
+    results = list(dotdensity.generate_points_mp(path, "population", counter=counter))
+    nonempty = [f for f in fc.features if f.properties["population"]]
+
+    assert len(results) == len(nonempty)
+    assert counter["features"] == len(fc.features)
+    assert counter["skipped"] == len(fc.features) - len(nonempty)
+    assert all(results)
+
+
+def test_split_groups():
+    groups = {"red": 4400, "blue": 3300, "green": 2300, "none": 0}
+    batches = list(dotdensity.split_groups(groups, 1000))
+
+    assert len(batches) == 10
+    assert all(sum(batch.values()) == 1000 for batch in batches)
+    for key, population in groups.items():
+        assert sum(batch[key] for batch in batches) == population
+
+
+def test_split_groups_small():
+    "Features smaller than a batch come back unchanged"
+    groups = {"red": 44, "blue": 33}
+
+    assert list(dotdensity.split_groups(groups, 1000)) == [groups]
+
+
+def test_iter_points_in_feature():
+    f = feature(0, 8, white=5000, black=2500)
+    batches = list(
+        dotdensity.iter_points_in_feature(f, ["white", "black"], batch_size=1000)
+    )
+    points = list(itertools.chain(*batches))
+    groups = regroup(points, lambda p: p.group)
+
+    assert len(batches) == 8
+    assert all(len(batch) <= 1000 for batch in batches)
+    assert len(groups["white"]) == 5000
+    assert len(groups["black"]) == 2500
+
+
+def test_generate_points_mp_batches(tmp_path):
+    "Large features are split into batches before they're sent to workers"
+    f = feature(0, 5, population=1050)
+    while not geometry.shape(f.geometry).is_valid:
+        f = feature(0, 5, population=1050)
+
+    path = tmp_path / "big.geojson"
+    path.write_text(geojson.dumps(geojson.FeatureCollection([f])))
+
+    tasks = list(dotdensity.split_features([f], ["population"], batch_size=100))
+    results = list(dotdensity.generate_points_mp(path, "population", batch_size=100))
+
+    assert len(tasks) == len(results) == 11
+    assert all(len(points) <= 100 for points in results)
+    assert sum(len(points) for points in results) == 1050
+
+
+def test_chunk_tasks():
+    "Chunks hold at most one batch of dots, so big features spread across workers"
+    big = feature("big", 8, population=1050)
+    small = [feature(i, 5, population=10) for i in range(30)]
+    tasks = list(
+        dotdensity.split_features([*small, big, *small], ["population"], batch_size=100)
+    )
+    chunks = list(dotdensity.chunk_tasks(tasks, chunksize=500, batch_size=100))
+    sizes = [sum(dotdensity.task_size(task) for task in chunk) for chunk in chunks]
+
+    assert [task for chunk in chunks for task in chunk] == tasks
+    assert all(size <= 100 for size in sizes)
+
+    # every batch of the big feature goes in a different chunk
+    big = [sum(t[0].id == "big" for t in chunk) for chunk in chunks]
+    assert big.count(1) == 11
+    assert max(big) == 1
+
+    # small features are still grouped
+    assert len(chunks) < len(tasks) / 2
+
+
+def test_chunk_tasks_chunksize():
+    tasks = list(
+        dotdensity.split_features(
+            [feature(i, 5, population=1) for i in range(10)], ["population"]
+        )
+    )
+    chunks = list(dotdensity.chunk_tasks(tasks, chunksize=3))
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+
+
+def test_generate_sources_mp(tmp_path, feature_collection):
+    "Sources share a pool, largest first, and each source's points stay together"
+    small = tmp_path / "small.geojson"
+    large = tmp_path / "large.geojson"
+    small.write_text(
+        geojson.dumps(geojson.FeatureCollection(feature_collection.features[:2]))
+    )
+    large.write_text(geojson.dumps(feature_collection))
+
+    pairs = list(dotdensity.generate_sources_mp([small, large], "population"))
+    order = [src for src, _ in itertools.groupby(src for src, points in pairs)]
+
+    assert order == [large, small]
+    assert sum(len(points) for src, points in pairs) == 100 * (
+        len(feature_collection.features) + 2
+    )
+
+
+@pytest.mark.parametrize("by", ["range", "hash"])
+def test_partition_features(by):
+    features = [feature(i, 5, population=10) for i in range(100)]
+    parts = [
+        list(dotdensity.partition_features(features, (i, 3), by=by)) for i in range(3)
+    ]
+    ids = sorted(f.id for part in parts for f in part)
+
+    assert ids == list(range(100))
+    assert all(parts)
+
+
+def test_partition_out_of_range():
+    with pytest.raises(ValueError):
+        dotdensity.partition_features([], (3, 3))
+
+
+def test_seed(source):
+    "Seeded runs give the same points, with or without multiprocessing"
+    first = list(dotdensity.generate_points(source, "population", seed=1))
+    second = list(dotdensity.generate_points(source, "population", seed=1))
+    mp = list(dotdensity.generate_points_mp(source, "population", seed=1))
+    other = list(dotdensity.generate_points(source, "population", seed=2))
+
+    assert first == second == mp
+    assert first != other
+
+
+def test_seed_sources(tmp_path, source):
+    "Features with the same ID in different sources get different points"
+    other = tmp_path / "other.geojson"
+    other.write_text(source.read_text())
+
+    first = list(dotdensity.generate_points(source, "population", seed=1))
+    second = list(dotdensity.generate_points(other, "population", seed=1))
+    pairs = list(dotdensity.generate_sources_mp([source, other], "population", seed=1))
+
+    assert [(p.x, p.y) for p in first[0]] != [(p.x, p.y) for p in second[0]]
+    assert [points for src, points in pairs if src == source and points] == first
+    assert [points for src, points in pairs if src == other and points] == second
+
+
+def test_seed_batches():
+    "Seeds carry through batches of large features"
+    f = feature("big", 8, white=500, black=250)
+    keys = ["white", "black"]
+
+    batches = list(dotdensity.iter_points_in_feature(f, keys, batch_size=100, seed=1))
+    tasks = list(dotdensity.split_features([f], keys, batch_size=100, seed=1))
+    from_tasks = [
+        dotdensity.points_in_batch(feature, groups, rng=dotdensity.get_rng(seed))
+        for feature, groups, seed, _ in tasks
+    ]
+
+    assert batches == from_tasks
+
+
+def test_points_from_features(feature_collection):
+    "In-memory features, bare or in a collection, match what's read from a file"
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    bare = list(
+        itertools.chain(
+            *dotdensity.points_from_features(
+                feature_collection.features, "population", seed=1
+            )
+        )
+    )
+    collection = list(
+        itertools.chain(
+            *dotdensity.points_from_features(feature_collection, "population", seed=1)
+        )
+    )
+
+    assert len(bare) == population
+    assert bare == collection
+
+
+def test_points_from_features_mp(feature_collection):
+    points = list(
+        dotdensity.points_from_features(feature_collection, "population", seed=1)
+    )
+    mp = list(
+        dotdensity.points_from_features_mp(feature_collection, "population", seed=1)
+    )
+
+    assert points == mp
+
+
+def strip(length=1000):
+    "A long, thin shape with lots of triangles of the same size, end to end"
+    bottom = [(x, 0) for x in range(length + 1)]
+    top = [(x, 1) for x in range(length, -1, -1)]
+    return geometry.Polygon(bottom + top)
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_batches_cover_whole_feature(mp):
+    "Small batches over many triangles still spread dots evenly"
+    f = geojson.Feature(1, geometry.mapping(strip()), {"population": 20000})
+    if mp:
+        tasks = dotdensity.split_features([f], ["population"], batch_size=1000)
+        batches = [
+            dotdensity.points_in_batch(feature, groups, rng=dotdensity.get_rng(seed))
+            for feature, groups, seed, _ in tasks
+        ]
+    else:
+        batches = dotdensity.iter_points_in_feature(
+            f, ["population"], batch_size=1000, seed=1
+        )
+
+    xs = [p.x for p in itertools.chain(*batches)]
+    counts, _ = np.histogram(xs, bins=10, range=(0, 1000))
+
+    assert len(xs) == 20000
+    assert all(1800 < n < 2200 for n in counts), counts
+
+
+def test_allocate_dots():
+    rng = np.random.RandomState(1)
+    for _ in range(10):
+        counts = dotdensity.allocate_dots([1, 1, 1], 10, rng=rng)
+        assert sum(counts) == 10
+        assert sorted(counts) == [3, 3, 4]
+
+    # shares under one dot are spread around, not always given to the first
+    totals = np.sum(
+        [dotdensity.allocate_dots([1] * 10, 3, rng=rng) for _ in range(1000)], axis=0
+    )
+    assert all(200 < n < 400 for n in totals), totals
+
+
+def circle(vertices):
+    "A detailed polygon, like a coastline"
+    return geometry.Point(0, 0).buffer(1, resolution=vertices // 4)
+
+
+def test_simplify_shape():
+    geom = circle(1000)
+    stats = Stats()
+    simple = dotdensity.simplify_shape(geom, 0.01, stats=stats)
+
+    assert simple.is_valid
+    assert dotdensity.count_vertices(simple) < dotdensity.count_vertices(geom)
+    assert simple.area == pytest.approx(geom.area, rel=0.01)
+    assert stats.counts["simplified"] == 1
+    assert stats.counts["vertices_saved"] > 0
+    assert stats.counts["triangles_saved"] > 0
+
+
+def test_simplify_shape_without_stats(monkeypatch):
+    "Saved triangles are only counted when stats are on"
+
+    def count_triangles(geom):
+        raise AssertionError("counted triangles without stats")
+
+    monkeypatch.setattr(dotdensity, "count_triangles", count_triangles)
+    geom = circle(1000)
+
+    for stats in [None, NullStats()]:
+        simple = dotdensity.simplify_shape(geom, 0.01, stats=stats)
+        assert dotdensity.count_vertices(simple) < dotdensity.count_vertices(geom)
+
+
+def test_simplify_skips_simple_shapes():
+    geom = circle(8)
+    assert dotdensity.simplify_shape(geom, 0.1, min_vertices=100) is geom
+
+
+def test_count_triangles():
+    geom = circle(200)
+    assert dotdensity.count_triangles(geom) == len(triangulate(geom))
+
+
+def test_points_in_feature_simplify():
+    f = geojson.Feature(1, geometry.mapping(circle(1000)), {"population": 1000})
+    points = list(
+        itertools.chain(
+            *dotdensity.iter_points_in_feature(f, ["population"], simplify=0.01)
+        )
+    )
+
+    assert len(points) == 1000
+
+
+def islands():
+    "A big island and a small one, far apart"
+    return geometry.MultiPolygon(
+        [geometry.box(0, 0, 10, 10), geometry.box(100, 100, 101, 101)]
+    )
+
+
+def test_allocate_population():
+    counts = dotdensity.allocate_population([1, 1, 1], 10)
+
+    assert sum(counts) == 10
+    assert sorted(counts) == [3, 3, 4]
+    assert dotdensity.allocate_population([5], 7) == [7]
+
+
+def test_points_in_multipolygon():
+    "Each part gets its share of points by area, so small islands aren't starved"
+    geom = islands()
+    big, small = geom.geoms
+    points = dotdensity.points_in_shape(geom, 1010)
+
+    assert len(points) == 1010
+    assert sum(big.contains(geometry.Point(p)) for p in points) == 1000
+    assert sum(small.contains(geometry.Point(p)) for p in points) == 10
+
+
+def test_triangulate_parts():
+    geom = islands()
+    parts = dotdensity.triangulate_parts(geom)
+
+    assert [area for _, area in parts] == [100, 1]
+    assert all(t.within(geom) for triangles, _ in parts for t in triangles)
+    assert dotdensity.count_triangles(geom) == sum(len(t) for t, _ in parts)
+
+
+def test_split_parts():
+    f = geojson.Feature("islands", geometry.mapping(islands()), {"a": 700, "b": 310})
+    groups = {"a": 700, "b": 310}
+    parts = list(dotdensity.split_parts(f, groups, batch_size=100))
+
+    assert len(parts) == 2
+    assert [sum(g.values()) for _, g in parts] == [1000, 10]
+    assert {k: sum(g[k] for _, g in parts) for k in groups} == groups
+    assert all(p["geometry"]["type"] == "Polygon" for p, _ in parts)
+    assert all(p["id"] == "islands" for p, _ in parts)
+
+    # small features stay whole
+    assert list(dotdensity.split_parts(f, groups)) == [(f, groups)]
+
+
+def test_seed_multipolygon_batches():
+    "Large multi-part features give the same points whether split into tasks or not"
+    f = geojson.Feature("islands", geometry.mapping(islands()), {"a": 700, "b": 310})
+    keys = ["a", "b"]
+
+    batches = list(dotdensity.iter_points_in_feature(f, keys, batch_size=100, seed=1))
+    tasks = list(dotdensity.split_features([f], keys, batch_size=100, seed=1))
+    from_tasks = [
+        dotdensity.points_in_batch(feature, groups, rng=dotdensity.get_rng(seed))
+        for feature, groups, seed, _ in tasks
+    ]
+
+    assert len(tasks) == 11
+    assert batches == from_tasks
+    assert sum(len(batch) for batch in batches) == 1010
+
+
+def test_multipolygon_parts_spread_across_chunks():
+    "Parts of a big multi-part feature go to different workers"
+    geom = geometry.MultiPolygon(
+        [geometry.box(i * 10, 0, i * 10 + 5, 5) for i in range(4)]
+    )
+    f = geojson.Feature("islands", geometry.mapping(geom), {"population": 400})
+    tasks = list(dotdensity.split_features([f], ["population"], batch_size=150))
+    chunks = list(dotdensity.chunk_tasks(tasks, batch_size=150))
+
+    # one task per part, each in its own chunk
+    assert len(tasks) == len(chunks) == 4
+    assert all(task[0]["geometry"]["type"] == "Polygon" for task in tasks)
+
+    points = list(
+        dotdensity.points_from_features_mp([f], "population", batch_size=150, seed=1)
+    )
+    assert [len(batch) for batch in points] == [100] * 4
+
+
 def regroup(iterable, key):
     groups = {}
     iterable = sorted(iterable, key=key)
@@ -6,7 +6,7 @@ import pytest
 
 from dorchester import dotdensity
 from dorchester.point import Point
-from dorchester.output import CSVWriter, GeoJSONWriter
+from dorchester.output import CSVWriter, GeoJSONWriter, STDOUT
 
 
 @pytest.fixture
@@ -70,3 +70,27 @@ def test_write_geojson(points, tmpdir):
         assert [point.x, point.y] == feature.geometry.coordinates
         assert point.group == feature.properties["group"]
         assert point.fid == feature.properties["fid"]
+
+
+def test_write_csv_stdout(points, capsys):
+    with CSVWriter(STDOUT) as writer:
+        writer.write_all(points)
+
+    out = capsys.readouterr().out
+    rows = list(csv.DictReader(out.splitlines()))
+
+    assert len(rows) == len(points)
+
+
+def test_write_geojson_stdout(points, capsys):
+    with GeoJSONWriter(STDOUT) as writer:
+        writer.write_all(points)
+
+    out = capsys.readouterr().out
+    features = [geojson.loads(line) for line in out.splitlines()]
+
+    assert len(features) == len(points)
+
+    # stdout is still usable afterward
+    print("done")
+    assert capsys.readouterr().out == "done\n"
@@ -0,0 +1,72 @@
+import itertools
+import threading
+
+import pytest
+
+from dorchester import dotdensity, pipeline
+
+
+class ListWriter:
+    "Collect batches in memory, noting which thread wrote them"
+
+    def __init__(self):
+        self.points = []
+        self.threads = set()
+
+    def write_all(self, points):
+        self.threads.add(threading.current_thread().name)
+        self.points.extend(points)
+
+
+def test_prefetch():
+    assert list(pipeline.prefetch(range(1000), 10)) == list(range(1000))
+
+
+def test_prefetch_error():
+    def broken():
+        yield 1
+        raise ValueError("bad feature")
+
+    items = pipeline.prefetch(broken())
+
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_prefetch_stop_early():
+    items = pipeline.prefetch(itertools.count(), 2)
+    assert next(items) == 0
+
+    # closing joins the reader thread, even though it's blocked on a full queue
+    items.close()
+    assert not any(t.name == "dorchester-reader" for t in threading.enumerate())
+
+
+def test_background_writer():
+    writer = ListWriter()
+    with pipeline.BackgroundWriter(writer, 2) as background:
+        for i in range(100):
+            background.write_all([i, i])
+
+    assert writer.points == [i for i in range(100) for _ in range(2)]
+    assert writer.threads == {"dorchester-writer"}
+
+
+def test_background_writer_error():
+    class BrokenWriter:
+        def write_all(self, points):
+            raise IOError("disk full")
+
+    with pytest.raises(IOError):
+        with pipeline.BackgroundWriter(BrokenWriter()) as background:
+            for i in range(100):
+                background.write_all([i])
+
+
+def test_generate_points_prefetch(source, feature_collection):
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    points = dotdensity.generate_points(source, "population", prefetch=2)
+    points = list(itertools.chain(*points))
+
+    assert len(points) == population
@@ -0,0 +1,78 @@
+import itertools
+import pickle
+
+import geojson
+import numpy as np
+import pytest
+from fiona.transform import transform_geom
+from shapely import geometry
+
+from dorchester import dotdensity
+from dorchester.reproject import Reprojector
+
+# a few blocks around Boston, in WGS84
+BLOCKS = [
+    [(-71.06, 42.35), (-71.05, 42.35), (-71.05, 42.36), (-71.06, 42.36)],
+    [(-71.08, 42.30), (-71.06, 42.30), (-71.07, 42.32)],
+]
+
+
+@pytest.fixture()
+def blocks(tmp_path):
+    features = [
+        geojson.Feature(i, geojson.Polygon([ring + ring[:1]]), {"population": 100})
+        for i, ring in enumerate(BLOCKS)
+    ]
+    path = tmp_path / "blocks.geojson"
+    path.write_text(geojson.dumps(geojson.FeatureCollection(features)))
+    return path
+
+
+def test_reproject():
+    reproject = Reprojector("EPSG:4326", "EPSG:3857")
+    coords = np.array([[0, 0], [-71.06, 42.35]])
+    result = reproject(coords)
+
+    assert result.shape == (2, 2)
+    assert result[0] == pytest.approx([0, 0])
+    assert result[1] == pytest.approx([-7910363.0, 5213552.8], abs=1)
+
+
+def test_roundtrip():
+    there = Reprojector("EPSG:4326", "EPSG:26986")
+    back = Reprojector("EPSG:26986", "EPSG:4326")
+    coords = np.array(BLOCKS[0])
+
+    assert back(there(coords)) == pytest.approx(coords)
+
+
+def test_empty():
+    reproject = Reprojector("EPSG:4326", "EPSG:3857")
+
+    assert reproject([]).shape == (0, 2)
+
+
+def test_pickle():
+    reproject = pickle.loads(pickle.dumps(Reprojector("EPSG:4326", "EPSG:3857")))
+
+    assert reproject.dst_crs == "EPSG:3857"
+
+
+@pytest.mark.parametrize("mp", [False, True])
+def test_generate_points_to_crs(blocks, mp):
+    generate_points = (
+        dotdensity.generate_points_mp if mp else dotdensity.generate_points
+    )
+    polygons = {
+        i: geometry.shape(
+            transform_geom("EPSG:4326", "EPSG:3857", geometry.mapping(polygon))
+        )
+        for i, polygon in enumerate(geometry.Polygon(ring) for ring in BLOCKS)
+    }
+
+    batches = generate_points(blocks, "population", to_crs="EPSG:3857")
+    points = list(itertools.chain(*batches))
+
+    assert len(points) == 100 * len(BLOCKS)
+    for point in points:
+        assert polygons[int(point.fid)].contains(geometry.Point(point.x, point.y))
@@ -0,0 +1,79 @@
+import itertools
+import time
+
+from dorchester import dotdensity
+from dorchester.stats import NullStats, Stats
+
+
+def test_timer():
+    stats = Stats()
+    with stats.timer("sample"):
+        time.sleep(0.01)
+
+    assert stats.wall["sample"] >= 0.01
+    assert "sample" in stats.cpu
+
+
+def test_timed():
+    stats = Stats()
+    items = list(stats.timed(range(5), "read"))
+
+    assert items == [0, 1, 2, 3, 4]
+    assert "read" in stats.wall
+
+
+def test_null_stats():
+    stats = NullStats()
+    with stats.timer("sample"):
+        pass
+
+    assert list(stats.timed(range(3), "read")) == [0, 1, 2]
+    assert not stats.wall
+
+
+def test_update():
+    a, b = Stats(), Stats()
+    a.wall["sample"] = 1
+    b.wall["sample"] = 2
+    a.counts["dots"] = 10
+    b.counts["dots"] = 5
+    a.rss = {1: 100}
+    b.rss = {1: 50, 2: 200}
+
+    a.update(b)
+
+    assert a.wall["sample"] == 3
+    assert a.counts["dots"] == 15
+    assert a.rss == {1: 100, 2: 200}
+    assert a.as_dict()["peak_rss"] == 300
+
+
+def test_generate_points_stats(source, feature_collection):
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    stats = Stats()
+    points = dotdensity.generate_points(
+        source, "population", counter=stats.counts, stats=stats
+    )
+    points = list(itertools.chain(*points))
+    stats.finish()
+
+    assert stats.counts["dots"] == len(points) == population
+    assert stats.counts["features"] == len(feature_collection.features)
+    for stage in ["read", "parse", "triangulate", "sample", "points"]:
+        assert stage in stats.wall
+
+    data = stats.as_dict()
+    assert data["dots_per_second"] > 0
+    assert "sample" in stats.report()
+
+
+def test_generate_points_mp_stats(source, feature_collection):
+    population = sum(f.properties["population"] for f in feature_collection.features)
+    stats = Stats()
+    points = dotdensity.generate_points_mp(source, "population", stats=stats)
+    points = list(itertools.chain(*points))
+
+    # dots are counted in workers and merged back
+    assert stats.counts["dots"] == len(points) == population
+    assert "triangulate" in stats.wall
+    assert len(stats.rss) >= 1
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+# sampling arrays needs Shapely 2's vectorized functions
+shapely = pytest.importorskip("shapely", minversion="2.0")
+
+from shapely import geometry
+
+from dorchester.vectorized import allocate, points_from_arrays, sample_geometries
+
+GEOMETRIES = np.array(
+    [
+        geometry.box(0, 0, 2, 1),
+        None,
+        geometry.Polygon(
+            [(0, 0), (4, 0), (4, 4), (0, 4)], [[(1, 1), (3, 1), (3, 3), (1, 3)]]
+        ),
+        geometry.MultiPolygon(
+            [geometry.box(10, 10, 11, 11), geometry.box(20, 20, 23, 21)]
+        ),
+    ]
+)
+
+
+def test_sample_geometries():
+    populations = [50, 10, 200, 40]
+    coords, index = sample_geometries(GEOMETRIES, populations)
+
+    # nothing goes in a missing geometry
+    assert np.bincount(index, minlength=4).tolist() == [50, 0, 200, 40]
+    assert (np.diff(index) >= 0).all()
+
+    for i, geom in enumerate(GEOMETRIES):
+        if geom is not None:
+            xs, ys = coords[index == i].T
+            assert shapely.intersects_xy(geom, xs, ys).all()
+
+
+def test_sample_geometries_avoids_holes():
+    coords, index = sample_geometries(GEOMETRIES[2:3], [1000])
+    hole = geometry.box(1, 1, 3, 3)
+
+    assert not shapely.contains_xy(hole, *coords.T).any()
+
+
+def test_sample_geometries_empty():
+    coords, index = sample_geometries(GEOMETRIES, [0, 0, 0, 0])
+
+    assert coords.shape == (0, 2)
+    assert len(index) == 0
+
+
+def test_sample_geometries_shapes_must_match():
+    with pytest.raises(ValueError):
+        sample_geometries(GEOMETRIES, [1, 2])
+
+
+def test_sample_geometries_seed():
+    first = sample_geometries(GEOMETRIES, [5, 0, 5, 5], rng=np.random.RandomState(1))
+    second = sample_geometries(GEOMETRIES, [5, 0, 5, 5], rng=np.random.RandomState(1))
+
+    assert np.array_equal(first[0], second[0])
+
+
+def test_allocate():
+    "Largest remainders give exact totals, split by area"
+    areas = np.array([1.0, 1.0, 1.0, 3.0, 1.0])
+    owners = np.array([0, 0, 0, 1, 1])
+    counts = allocate(areas, owners, np.array([10, 7]), 2)
+
+    assert counts[:3].sum() == 10
+    assert sorted(counts[:3].tolist()) == [3, 3, 4]
+    assert counts[3:].tolist() == [5, 2]
+
+
+def test_points_from_arrays():
+    groups = {"white": [20, 5, 30, 10], "black": [10, 5, 15, 0]}
+    points = points_from_arrays(GEOMETRIES, groups, fids=["a", "b", "c", "d"])
+
+    counts = {}
+    for point in points:
+        key = (point.fid, point.group)
+        counts[key] = counts.get(key, 0) + 1
+        assert isinstance(point.x, float)
+
+    assert counts == {
+        ("a", "white"): 20,
+        ("a", "black"): 10,
+        ("c", "white"): 30,
+        ("c", "black"): 15,
+        ("d", "white"): 10,
+    }
+
+
+def test_points_from_arrays_default_fids():
+    points = points_from_arrays(GEOMETRIES[:1], {"population": [10]})
+
+    assert len(points) == 10
+    assert {p.fid for p in points} == {0}
+
+
+def test_sample_geometries_by_part(monkeypatch):
+    "Multipolygons are triangulated one part at a time, with dots split by area"
+    triangulated = []
+    delaunay_triangles = shapely.delaunay_triangles
+
+    def record(geometries, *args, **kwargs):
+        triangulated.extend(shapely.get_type_id(geometries).tolist())
+        return delaunay_triangles(geometries, *args, **kwargs)
+
+    monkeypatch.setattr(shapely, "delaunay_triangles", record)
+    islands = geometry.MultiPolygon(
+        [geometry.box(0, 0, 10, 10), geometry.box(100, 100, 101, 101)]
+    )
+    coords, index = sample_geometries([islands], [1010])
+    xs, ys = coords.T
+
+    # every geometry passed in is a polygon
+    assert set(triangulated) == {shapely.GeometryType.POLYGON}
+    assert shapely.contains_xy(islands.geoms[0], xs, ys).sum() == 1000
+    assert shapely.contains_xy(islands.geoms[1], xs, ys).sum() == 10